@@ -0,0 +1,456 @@
+"""Kargo bot için çevrimdışı yük testi / benchmark.
+
+Gerçek handler'ları (kargo, kalanhak, rapor) sentetik Update nesneleriyle, çok
+sayıda sanal gruptan çalıştırır. /api/tracking yerine gecikmesi ve hata oranı
+ayarlanabilen yerel bir sunucu, Telegram yerine gönderilen mesajları kaydeden
+sahte bir bot kullanılır; ağa hiç çıkılmaz, DB geçici bir dosyadır.
+
+    python bench.py --groups 50 --commands 2000 --latency 0.05 --error-rate 0.02
+
+Çıktı: throughput, handler ve uçtan uca (son cevaba kadar) p50/p95/p99
+gecikmeleri, komut başına SQLite süresi.
+
+--workers N ile BOT_WORKERS modundaki gibi N işçi süreç aynı SQLite dosyasını
+paylaşır. Ana süreç supervisor gibi davranır: update'leri WorkerPool.route ile
+chat_id'ye göre işçilerin kuyruklarına yollar. Her işçi kendi sahte backend'ini
+ve kısaltıcılarını çalıştırır, böylece sahte sunucular ortak bir darboğaz olmaz:
+
+    python bench.py --groups 64 --commands 4000 --workers 4
+"""
+import argparse, asyncio, contextvars, json, multiprocessing as mp, os, random, statistics, sys, tempfile, time
+
+# bot.py import edilirken env okunur; benchmark için güvenli varsayılanlar.
+# BENCH_DB_PATH env'e yazılır ki --workers ile açılan süreçler aynı dosyayı kullansın.
+if not os.environ.get("BENCH_DB_PATH"):
+    os.environ["BENCH_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="kargo-bench-"), "bench.sqlite")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ["BOT_DB_PATH"] = os.environ["BENCH_DB_PATH"]
+os.environ.setdefault("OUTBOX_BASE_BACKOFF", "0.05")
+os.environ.setdefault("OUTBOX_MAX_BACKOFF", "0.5")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Kargo bot çevrimdışı yük testi")
+    p.add_argument("--groups", type=int, default=50, help="sanal grup sayısı")
+    p.add_argument("--commands", type=int, default=2000, help="toplam komut sayısı")
+    p.add_argument("--concurrency", type=int, default=100, help="aynı anda işlenen update sayısı")
+    p.add_argument("--mix", default="kargo=0.85,kalanhak=0.1,rapor=0.05",
+                   help="komut dağılımı, ör. kargo=0.8,kalanhak=0.2")
+    p.add_argument("--batch", type=int, default=1, help="her /kargo mesajındaki gönderi sayısı")
+    p.add_argument("--latency", type=float, default=0.05, help="sahte /api/tracking gecikmesi (sn)")
+    p.add_argument("--jitter", type=float, default=0.02, help="gecikmeye eklenen rastgele sapma (sn)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="sahte API'nin 500 döndürme oranı")
+    p.add_argument("--short-latency", type=float, default=0.05,
+                   help="sahte kısaltıcıların gecikmesi (sn); ilk sağlayıcı bunun 3 katı yavaştır")
+    p.add_argument("--short-error-rate", type=float, default=0.0, help="sahte kısaltıcıların hata oranı")
+    p.add_argument("--no-shortener", action="store_true", help="link kısaltmayı kapat")
+    p.add_argument("--tg-latency", type=float, default=0.0, help="sahte Telegram gönderim gecikmesi (sn)")
+    p.add_argument("--tg-limits", action="store_true",
+                   help="Telegram hız limitlerini gerçek değerlerinde bırak (varsayılan: kapalı)")
+    p.add_argument("--workers", type=int, default=1,
+                   help="işçi süreç sayısı; gruplar chat_id'ye göre paylaştırılır (BOT_WORKERS gibi)")
+    p.add_argument("--timeout", type=float, default=120, help="son cevapları bekleme süresi (sn)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", action="store_true", help="sonucu JSON olarak yazdır")
+    return p.parse_args(argv)
+
+
+args = parse_args()
+if not args.tg_limits:
+    os.environ.setdefault("TG_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("TG_CHAT_PER_MINUTE", "1000000")
+    os.environ.setdefault("TG_CHAT_BURST", "1000000")
+
+import logging
+import bot
+from telegram import Update
+
+logging.getLogger().setLevel(logging.WARNING)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+bot.log.setLevel(logging.ERROR)   # sahte API hataları için retry uyarıları çıktıyı boğmasın
+
+
+# ------------ SAHTE TELEGRAM ------------
+class FakeBot:
+    """ReplyScheduler'ın çağırdığı Bot metotlarını taklit eder ve her komutun
+    son cevabının ne zaman geldiğini kaydeder."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.next_id = 10**6
+        self.acks = {}          # ack message_id -> komut message_id
+        self.finished = {}      # komut message_id -> zaman
+        self.sent = 0
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def _delay(self):
+        self.sent += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _finish(self, origin):
+        if origin is not None and origin not in self.finished:
+            self.finished[origin] = time.perf_counter()
+            if len(self.finished) >= self.expected:
+                self.done.set()
+
+    def expect(self, n: int):
+        self.expected = n
+        if len(self.finished) >= n:
+            self.done.set()
+
+    async def send_message(self, chat_id, text, reply_parameters=None, **kw):
+        await self._delay()
+        self.next_id += 1
+        origin = reply_parameters.message_id if reply_parameters else None
+        if "hazırlanıyor" in text:
+            self.acks[self.next_id] = origin
+        else:
+            self._finish(origin)
+        return _FakeMessage(self.next_id)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kw):
+        await self._delay()
+        self._finish(self.acks.get(message_id))
+        return True
+
+    async def send_document(self, chat_id, document, **kw):
+        await self._delay()
+        return _FakeMessage(0)
+
+
+class _FakeMessage:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+# ------------ SAHTE /api/tracking ------------
+class FakeTracking:
+    def __init__(self, latency: float, jitter: float, error_rate: float):
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.calls = 0
+        self.errors = 0
+
+    async def __call__(self, headers: dict, body: bytes):
+        # id await'ten önce alınır: eşzamanlı istekler aynı takip no'yu/linki paylaşmasın
+        n = self.calls = self.calls + 1
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return 500, "application/json", b'{"error":"fake"}'
+        tid = f"B{n:07d}"
+        return 200, "application/json", json.dumps({"id": tid, "url": f"http://bench/t/{tid}"}).encode()
+
+
+# ------------ SAHTE KISALTICILAR ------------
+class FakeShortener:
+    def __init__(self, name: str, latency: float, error_rate: float):
+        self.name, self.latency, self.error_rate = name, latency, error_rate
+        self.calls = 0
+
+    async def __call__(self, headers: dict, body: bytes):
+        n = self.calls = self.calls + 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            return 503, "text/plain", b"unavailable"
+        short = f"http://s.bench/{self.name}/{n}"
+        if self.name == "cleanuri":
+            return 200, "application/json", json.dumps({"result_url": short}).encode()
+        return 200, "text/plain", short.encode()
+
+
+# ------------ SQLITE ZAMANI ------------
+# run_db'yi sarmalayarak komut başına (handler içindeki) ve toplam DB süresini ölçer.
+_cmd_db_time = contextvars.ContextVar("cmd_db_time", default=None)
+db_total = [0.0]
+_orig_run_db = bot.run_db
+
+async def timed_run_db(fn, *a):
+    t0 = time.perf_counter()
+    try:
+        return await _orig_run_db(fn, *a)
+    finally:
+        elapsed = time.perf_counter() - t0
+        db_total[0] += elapsed
+        acc = _cmd_db_time.get()
+        if acc is not None:
+            acc[0] += elapsed
+
+bot.run_db = timed_run_db
+
+
+# ------------ YÜK ------------
+def make_update(fake: FakeBot, update_id: int, chat_id: int, text: str, username: str) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": f"Bench Grup {-chat_id}"},
+            "from": {"id": 1, "is_bot": False, "first_name": "b", "username": username},
+            "text": text,
+        },
+    }, fake)
+
+
+def kargo_text(n: int) -> str:
+    blocks = [f"Müşteri {random.randint(1, 10**6)}\nÖrnek Mah. {random.randint(1, 99)}. Sok.\n"
+              f"{random.randint(1, 28):02d}.10.2026\nFirma {random.randint(1, 5)}" for _ in range(n)]
+    return "/kargo\n" + "\n\n".join(blocks)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+async def start_fakes():
+    """Sahte /api/tracking ve kısaltıcıları yerel bir sunucuda başlatır."""
+    tracking = FakeTracking(args.latency, args.jitter, args.error_rate)
+    bot.web_routes[("POST", "/api/tracking")] = tracking
+    server = await bot.start_web_server(0, "127.0.0.1")
+    api_base = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    shorteners = {}
+    if not args.no_shortener:
+        # İlk sağlayıcı bilerek yavaş: hedge'in devreye girdiği görülsün
+        for i, (name, (method, *_)) in enumerate(bot.SHORTENERS.items()):
+            latency = args.short_latency * (3 if i == 0 else 1)
+            shorteners[name] = FakeShortener(name, latency, args.short_error_rate)
+            bot.web_routes[(method, f"/short/{name}")] = shorteners[name]
+    return server, api_base, tracking, shorteners
+
+
+def point_bot_at(api_base: str):
+    bot.API_BASE = api_base
+    if args.no_shortener:
+        bot.SHORTENER_ORDER = []
+        return
+    for name, (method, _, how, parse) in bot.SHORTENERS.items():
+        bot.SHORTENERS[name] = (method, f"{api_base}/short/{name}", how, parse)
+
+
+HANDLERS = {"kargo": bot.kargo, "kalanhak": bot.kalanhak, "rapor": bot.rapor}
+
+
+def command_mix() -> dict:
+    mix = {}
+    for part in args.mix.split(","):
+        name, _, w = part.partition("=")
+        mix[name.strip()] = float(w or 1)
+    unknown = set(mix) - set(HANDLERS)
+    if unknown:
+        raise SystemExit(f"Bilinmeyen komut: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def build_plan(fake) -> list:
+    """Bütün gruplar için [(komut, Update), ...]; her süreçte aynı seed ile aynıdır."""
+    random.seed(args.seed)
+    names, weights = zip(*command_mix().items())
+    groups = [-(1000 + i) for i in range(args.groups)]
+    plan = []
+    for i in range(args.commands):
+        cmd = random.choices(names, weights)[0]
+        text = kargo_text(args.batch) if cmd == "kargo" else f"/{cmd}"
+        # update_id 1'den başlar; /hakver'lere bunların üstündeki id'ler verilir
+        plan.append((cmd, make_update(fake, i + 1, groups[i % len(groups)], text, bot.ADMIN_USERNAME)))
+    return plan
+
+
+def command_of(update: Update) -> str:
+    return update.message.text.split(maxsplit=1)[0].lstrip("/")
+
+
+async def drive_shard(index: int = 0, count: int = 1, inbox=None, barrier=None) -> dict:
+    """Bu shard'ın gruplarını çalıştırır, ham ölçümleri döner. inbox verilirse
+    update'ler (serve_worker gibi) supervisor'ın kuyruğundan okunur."""
+    server, api_base, tracking, shorteners = await start_fakes()
+    point_bot_at(api_base)
+    names = list(command_mix())
+
+    fake = FakeBot(args.tg_latency)
+    bot.OUTBOX_CONCURRENCY = max(bot.OUTBOX_CONCURRENCY, args.concurrency)
+    bot.OUTBOX_BATCH = max(bot.OUTBOX_BATCH, args.concurrency)
+    app = type("BenchApp", (), {"bot": fake})()
+    await bot.on_startup(app)
+
+    for i in range(args.groups):
+        chat_id = -(1000 + i)
+        if bot.shard_of(chat_id, count) != index:
+            continue
+        update_id = args.commands + 1 + i   # plan id'lerinin üstünde, süreçler arasında tekil
+        hakver = f"/hakver {args.commands * args.batch}"
+        await bot.hakver(make_update(fake, update_id, chat_id, hakver, bot.ADMIN_USERNAME), None)
+    await bot.sender.queue.join()
+    fake.finished.clear()
+    fake.done = asyncio.Event()
+    fake.expected = float("inf")
+
+    # Üretimdeki gibi: farklı grupların komutları paralel, aynı grubunkiler sırayla
+    processor = bot.ChatOrderedUpdateProcessor(args.concurrency)
+    stats = {name: {"lat": [], "db": []} for name in names}
+    starts = {}
+
+    async def drive(cmd, update):
+        acc = [0.0]
+        _cmd_db_time.set(acc)
+        t0 = time.perf_counter()
+        await HANDLERS[cmd](update, None)
+        stats[cmd]["lat"].append(time.perf_counter() - t0)
+        stats[cmd]["db"].append(acc[0])
+
+    def submit(update):
+        cmd = command_of(update)
+        starts[update.message.message_id] = (cmd, time.perf_counter())
+        return asyncio.create_task(processor.process_update(update, drive(cmd, update)))
+
+    loop = asyncio.get_running_loop()
+    plan = build_plan(fake) if inbox is None else None
+    if barrier is not None:   # bütün işçiler ve supervisor aynı anda başlasın
+        await loop.run_in_executor(None, barrier.wait)
+    db_total[0] = 0.0
+    t_start = time.perf_counter()
+    if plan is not None:
+        tasks = [submit(u) for _, u in plan]
+    else:
+        tasks = []
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            tasks.append(submit(Update.de_json(data, fake)))
+    fake.expect(len(tasks))
+    await asyncio.gather(*tasks)
+    t_handlers = time.perf_counter() - t_start
+    if tasks:
+        try:
+            await asyncio.wait_for(fake.done.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+    t_total = time.perf_counter() - t_start
+
+    e2e = {name: [] for name in names}
+    for mid, t_end in fake.finished.items():
+        if mid in starts:
+            cmd, t0 = starts[mid]
+            e2e[cmd].append(t_end - t0)
+
+    await bot.on_shutdown(app)
+    # Hedge'de iptal edilen isteklerin sahte sunucudaki karşılıkları bitsin
+    await asyncio.sleep(3 * args.short_latency + args.latency + args.jitter)
+    server.close()
+    await server.wait_closed()
+    return {
+        "commands": len(tasks),
+        "completed": len(fake.finished),
+        "handler_wall_s": t_handlers,
+        "total_wall_s": t_total,
+        "api_calls": tracking.calls,
+        "api_errors": tracking.errors,
+        "telegram_calls": fake.sent,
+        "shortener_calls": {name: f.calls for name, f in shorteners.items()},
+        "sqlite_total_s": db_total[0],
+        "lat": {name: s["lat"] for name, s in stats.items()},
+        "db": {name: s["db"] for name, s in stats.items()},
+        "e2e": e2e,
+    }
+
+
+def shard_main(index: int, count: int, inbox, barrier, results):
+    bot.WORKER_INDEX, bot.WORKER_COUNT = index, count
+    bot.TG_GLOBAL_RATE = bot.TG_GLOBAL_RATE / count   # worker_main() ile aynı paylaşım
+    results.put(asyncio.run(drive_shard(index, count, inbox, barrier)))
+
+
+async def run_workers() -> list:
+    """Supervisor tarafı: işçileri başlatır, planı WorkerPool.route ile dağıtır."""
+    pool = bot.WorkerPool(args.workers)   # yalnızca kuyrukları ve route() kullanılır
+    barrier, results = pool.ctx.Barrier(args.workers + 1), pool.ctx.Queue()
+    procs = [pool.ctx.Process(target=shard_main, args=(i, args.workers, pool.inboxes[i], barrier, results))
+             for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    plan = build_plan(None)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, barrier.wait)
+    for _, update in plan:
+        pool.route(update)
+    for q in pool.inboxes:
+        q.put(None)
+    parts = await loop.run_in_executor(None, lambda: [results.get() for _ in procs])
+    for p in procs:
+        await loop.run_in_executor(None, p.join)
+    return parts
+
+
+async def run():
+    parts = await run_workers() if args.workers > 1 else [await drive_shard()]
+
+    names = list(parts[0]["lat"])
+    merged = {key: {name: [v for part in parts for v in part[key][name]] for name in names}
+              for key in ("lat", "db", "e2e")}
+    commands = sum(part["commands"] for part in parts)
+    completed = sum(part["completed"] for part in parts)
+    t_total = max(part["total_wall_s"] for part in parts)
+    sqlite_total = sum(part["sqlite_total_s"] for part in parts)
+    shortener_calls = {}
+    for part in parts:
+        for name, n in part["shortener_calls"].items():
+            shortener_calls[name] = shortener_calls.get(name, 0) + n
+    return {
+        "workers": args.workers,
+        "commands": commands,
+        "completed": completed,
+        "handler_wall_s": max(part["handler_wall_s"] for part in parts),
+        "total_wall_s": t_total,
+        "throughput_cmd_s": completed / t_total if t_total else 0.0,
+        "api_calls": sum(part["api_calls"] for part in parts),
+        "api_errors": sum(part["api_errors"] for part in parts),
+        "telegram_calls": sum(part["telegram_calls"] for part in parts),
+        "shortener_calls": shortener_calls,
+        "sqlite_total_s": sqlite_total,
+        "sqlite_ms_per_cmd": 1000 * sqlite_total / max(1, commands),
+        "per_command": {
+            name: {
+                "count": len(merged["lat"][name]),
+                "handler_ms": {f"p{p}": 1000 * percentile(merged["lat"][name], p) for p in (50, 95, 99)},
+                "e2e_ms": {f"p{p}": 1000 * percentile(merged["e2e"][name], p) for p in (50, 95, 99)},
+                "handler_sqlite_ms": 1000 * statistics.fmean(merged["db"][name]) if merged["db"][name] else 0.0,
+            }
+            for name in names
+        },
+    }
+
+
+def print_report(r: dict):
+    print(f"İşçi: {r['workers']}  Komut: {r['commands']}  Tamamlanan: {r['completed']}  "
+          f"Süre: {r['total_wall_s']:.2f}s (handler'lar {r['handler_wall_s']:.2f}s)")
+    print(f"Throughput: {r['throughput_cmd_s']:.1f} komut/sn  API: {r['api_calls']} çağrı, "
+          f"{r['api_errors']} hata  Telegram: {r['telegram_calls']} çağrı")
+    if r["shortener_calls"]:
+        print("Kısaltıcı: " + ", ".join(f"{k} {v}" for k, v in r["shortener_calls"].items()))
+    print(f"SQLite: toplam {r['sqlite_total_s']:.3f}s, komut başına {r['sqlite_ms_per_cmd']:.2f} ms")
+    print(f"\n{'komut':<10}{'adet':>6}  {'handler p50/p95/p99 (ms)':>28}  {'uçtan uca p50/p95/p99 (ms)':>30}  {'sqlite ms':>9}")
+    for name, c in r["per_command"].items():
+        h, e = c["handler_ms"], c["e2e_ms"]
+        print(f"{name:<10}{c['count']:>6}  {h['p50']:>8.1f}{h['p95']:>10.1f}{h['p99']:>10.1f}  "
+              f"{e['p50']:>10.1f}{e['p95']:>10.1f}{e['p99']:>10.1f}  {c['handler_sqlite_ms']:>9.2f}")
+
+
+def main():
+    result = asyncio.run(run())
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,95 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-import os, sqlite3, logging, datetime as dt, requests, threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import os, sqlite3, logging, datetime as dt, threading, asyncio, json, signal, itertools, time, random, functools
+import csv, tempfile, contextlib
+import multiprocessing as mp
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from pathlib import Path
 from typing import Optional
+from zoneinfo import ZoneInfo
 
-from telegram import Update, Chat
+from telegram import Update, Chat, ReplyParameters
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, ContextTypes, filters
+    Application, BaseUpdateProcessor, CommandHandler, MessageHandler, TypeHandler, ContextTypes, filters
 )
 
-# ------------ RENDER İÇİN DUMMY WEB SERVER (EKLENDİ) ------------
-# Render Web Service bir port dinlemek zorundadır.
-# Bu basit sunucu Render'ı kandırıp uygulamanın "canlı" olduğunu söyler.
-
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(b"Bot calisiyor! (Kargo Bot)")
-
-def start_keep_alive():
-    port = int(os.environ.get("PORT", 8080))
-    server = HTTPServer(("0.0.0.0", port), HealthCheckHandler)
-    print(f"Dummy server {port} portunda baslatildi.")
-    server.serve_forever()
-
 # ------------ ENV ------------
 BOT_TOKEN      = os.environ.get("BOT_TOKEN")
 API_BASE       = os.environ.get("API_BASE", "http://localhost:3000")
 API_TOKEN      = os.environ.get("API_TOKEN", "change-me")
 ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "CengizzAtay").lstrip("@")
 
+# Backend'e giden HTTP istekleri: tek bir paylaşımlı async client (keep-alive)
+API_MAX_CONNECTIONS = int(os.environ.get("API_MAX_CONNECTIONS", "20"))
+API_CONNECT_TIMEOUT = float(os.environ.get("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT    = float(os.environ.get("API_READ_TIMEOUT", "15"))
+# Aynı anda işlenebilecek update sayısı (farklı gruplardan gelen /kargo'lar paralel yürür)
+BOT_CONCURRENCY     = int(os.environ.get("BOT_CONCURRENCY", "64"))
+# BOT_WORKERS > 1: update'leri chat_id'ye göre bu kadar işçi sürece dağıtan supervisor
+# modu. Hak defteri (groups.quota) ortak bot_state.sqlite'ta, transaction ile tutulur.
+BOT_WORKERS         = max(1, int(os.environ.get("BOT_WORKERS", "1")))
+WORKER_METRICS_INTERVAL = float(os.environ.get("WORKER_METRICS_INTERVAL", "5"))
+# Bu sürecin shard'ı (chat_id % WORKER_COUNT); işçi süreçlerde worker_main() ayarlar
+WORKER_INDEX, WORKER_COUNT = 0, 1
+# Toplu /kargo: tek mesajdaki en fazla gönderi sayısı ve backend'e paralel istek sayısı
+KARGO_BATCH_MAX         = int(os.environ.get("KARGO_BATCH_MAX", "50"))
+KARGO_BATCH_CONCURRENCY = int(os.environ.get("KARGO_BATCH_CONCURRENCY", "5"))
+# Telegram'a giden mesajlar için hız limitleri (flood limitlerinin biraz altında)
+TG_GLOBAL_RATE     = float(os.environ.get("TG_GLOBAL_RATE", "25"))        # mesaj/sn, tüm sohbetler
+TG_CHAT_PER_MINUTE = float(os.environ.get("TG_CHAT_PER_MINUTE", "20"))    # mesaj/dk, sohbet başına
+TG_CHAT_BURST      = int(os.environ.get("TG_CHAT_BURST", "3"))
+TG_SENDERS         = int(os.environ.get("TG_SENDERS", "4"))
+# Outbox: /kargo istekleri önce bot_state.sqlite'a yazılır, arka plandaki worker
+# backend'e gönderir; hata olursa üstel geri çekilmeyle tekrar dener.
+OUTBOX_BATCH        = int(os.environ.get("OUTBOX_BATCH", "20"))
+OUTBOX_CONCURRENCY  = int(os.environ.get("OUTBOX_CONCURRENCY", str(KARGO_BATCH_CONCURRENCY)))
+# İşlenmeye alınan satır bu kadar sn kiralanır; süreç çökerse kira bitince yeniden denenir
+OUTBOX_LEASE        = float(os.environ.get("OUTBOX_LEASE", "120"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BASE_BACKOFF = float(os.environ.get("OUTBOX_BASE_BACKOFF", "2"))
+OUTBOX_MAX_BACKOFF  = float(os.environ.get("OUTBOX_MAX_BACKOFF", "300"))
+# logs tablosu bu kadar günden eski ham kayıtları tutmaz (özetleri daily_counts'ta kalır)
+LOG_RETENTION_DAYS       = int(os.environ.get("LOG_RETENTION_DAYS", "90"))
+OUTBOX_RETENTION_DAYS    = int(os.environ.get("OUTBOX_RETENTION_DAYS", "7"))
+RETENTION_INTERVAL_HOURS = float(os.environ.get("RETENTION_INTERVAL_HOURS", "6"))
+RETENTION_BATCH          = int(os.environ.get("RETENTION_BATCH", "500"))
+EXPORT_CHUNK             = int(os.environ.get("EXPORT_CHUNK", "1000"))
+# Grup başlığı / son görülme zamanı diske bu aralıkla toplu yazılır (saniye)
+GROUP_FLUSH_INTERVAL = float(os.environ.get("GROUP_FLUSH_INTERVAL", "10"))
+
+# Render Web Service'in dinlemesi gereken port (health + opsiyonel webhook)
+PORT = int(os.environ.get("PORT", 8080))
+# WEBHOOK_URL verilirse (ör. https://kargo-bot.onrender.com) Telegram update'leri bu
+# porttan webhook ile alınır; verilmezse long polling'e düşülür.
+WEBHOOK_URL    = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH   = "/" + os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+# /health: DB ve backend kontrolleri için zaman aşımı ve sonucun önbellek süresi (sn)
+HEALTH_TIMEOUT       = float(os.environ.get("HEALTH_TIMEOUT", "3"))
+HEALTH_CACHE_SECONDS = float(os.environ.get("HEALTH_CACHE_SECONDS", "10"))
+
+# Günlük rapor günleri bu saat dilimine göre hesaplanır (logs.created_at UTC tutulur)
+BOT_TZ = ZoneInfo(os.environ.get("BOT_TZ", "Europe/Istanbul"))
+
 SHORTENER_ORDER = [
     s.strip().lower() for s in os.environ.get("SHORTENER_ORDER", "cleanuri,isgd,tinyurl").split(",")
     if s.strip()
 ]
 
+# Kısaltıcı: sıradaki sağlayıcı, öncekinden SHORTENER_HEDGE_DELAY içinde cevap
+# gelmezse başlatılır; /kargo cevabı en fazla SHORTENER_BUDGET kadar bekler.
+SHORTENER_HEDGE_DELAY       = float(os.environ.get("SHORTENER_HEDGE_DELAY", "0.3"))
+SHORTENER_TIMEOUT           = float(os.environ.get("SHORTENER_TIMEOUT", "3"))
+SHORTENER_BUDGET            = float(os.environ.get("SHORTENER_BUDGET", "1.5"))
+SHORTENER_BREAKER_FAILURES  = int(os.environ.get("SHORTENER_BREAKER_FAILURES", "3"))
+SHORTENER_BREAKER_COOLDOWN  = float(os.environ.get("SHORTENER_BREAKER_COOLDOWN", "60"))
+SHORTENER_MAX_CONNECTIONS   = int(os.environ.get("SHORTENER_MAX_CONNECTIONS", "20"))   # sağlayıcı başına
+
 if not BOT_TOKEN:
     raise SystemExit("BOT_TOKEN env eksik")
 
@@ -46,17 +97,186 @@ if not BOT_TOKEN:
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 log = logging.getLogger("kargo-bot")
 
+# ------------ METRICS ------------
+# Prometheus metin formatında basit sayaç/histogramlar; $PORT üzerinde /metrics.
+# Her komut için süre; toplam, sqlite, backend ve telegram fazlarına ayrılır.
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_metrics: list = []
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.values: dict = {} if labelnames else {(): 0}
+        _metrics.append(self)
+
+    def inc(self, *labels, n: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + n
+
+    def snapshot(self) -> dict:
+        return dict(self.values)
+
+    def samples(self, data: dict, extra: tuple = ()) -> list:
+        names = self.labelnames + extra[:1]
+        return [f"{self.name}{_fmt_labels(names, labels + extra[1:])} {v}"
+                for labels, v in sorted(data.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = METRIC_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, buckets
+        self.series: dict = {}   # labels -> [bucket sayıları, toplam, adet]
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                s[0][i] += 1
+        s[1] += value
+        s[2] += 1
+
+    def snapshot(self) -> dict:
+        return {labels: (list(counts), total, n) for labels, (counts, total, n) in self.series.items()}
+
+    def samples(self, data: dict, extra: tuple = ()) -> list:
+        names, ex = self.labelnames + extra[:1], extra[1:]
+        out = []
+        for labels, (counts, total, n) in sorted(data.items()):
+            for b, c in zip(self.buckets, counts):
+                out.append(f"{self.name}_bucket{_fmt_labels(names + ('le',), labels + ex + (b,))} {c}")
+            out.append(f"{self.name}_bucket{_fmt_labels(names + ('le',), labels + ex + ('+Inf',))} {n}")
+            out.append(f"{self.name}_sum{_fmt_labels(names, labels + ex)} {total}")
+            out.append(f"{self.name}_count{_fmt_labels(names, labels + ex)} {n}")
+        return out
+
+def _fmt_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+def metrics_snapshot() -> dict:
+    return {m.name: m.snapshot() for m in _metrics}
+
+def render_metrics(workers: Optional[dict] = None) -> str:
+    """Bu sürecin metrikleri; workers verilirse (worker -> metrics_snapshot())
+    işçi süreçlerinin metrikleri worker etiketiyle eklenir."""
+    out = []
+    for m in _metrics:
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        out.extend(m.samples(m.snapshot()))
+        for w, snap in sorted((workers or {}).items()):
+            if m.name in snap:
+                out.extend(m.samples(snap[m.name], ("worker", w)))
+    return "\n".join(out) + "\n"
+
+COMMAND_SECONDS = Histogram(
+    "kargo_bot_command_seconds",
+    "Komut süreleri. phase=total/sqlite handler çağrısı başına; backend ve telegram çağrı başına.",
+    ("command", "phase"),
+)
+QUOTA_REJECTIONS = Counter("kargo_bot_quota_rejections_total", "Hak yetersiz olduğu için reddedilen /kargo sayısı")
+DISABLED_HITS    = Counter("kargo_bot_disabled_hits_total", "Kapalı gruplardan gelen /kargo sayısı")
+API_FAILURES     = Counter("kargo_bot_api_failures_total", "Başarısız /api/tracking çağrıları", ("reason",))
+SHORTENER_CALLS  = Counter("kargo_bot_shortener_calls_total", "Kısaltıcı çağrıları", ("provider", "result"))
+READY            = Gauge("kargo_bot_ready", "Son sağlık kontrolünde bileşen durumu (1=hazır)", ("component",))
+
+# Şu an çalışan komutun adı ve faz süreleri (task başına ayrı kopya)
+_metric_cmd: ContextVar = ContextVar("metric_cmd", default="background")
+_metric_acc: ContextVar = ContextVar("metric_acc", default=None)
+
+def add_phase_time(phase: str, seconds: float):
+    acc = _metric_acc.get()
+    if acc is not None:
+        acc[phase] = acc.get(phase, 0.0) + seconds
+
+@contextlib.contextmanager
+def timed(name: str):
+    """Blok içindeki işin toplam ve SQLite süresini `name` komutu olarak kaydeder.
+    Handler olmayan arka plan işleri (ör. outbox) doğrudan bunu kullanır."""
+    cmd_token = _metric_cmd.set(name)
+    acc_token = _metric_acc.set({})
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        COMMAND_SECONDS.observe(time.perf_counter() - t0, name, "total")
+        COMMAND_SECONDS.observe(_metric_acc.get().get("sqlite", 0.0), name, "sqlite")
+        _metric_acc.reset(acc_token)
+        _metric_cmd.reset(cmd_token)
+
+def instrument(name: str, fn):
+    """Handler'ı sarar: toplam süre ve handler içindeki SQLite süresini kaydeder."""
+    @functools.wraps(fn)
+    async def wrapper(update, ctx):
+        with timed(name):
+            return await fn(update, ctx)
+    return wrapper
+
 # ------------ DB (ÇÖZÜM BURADA) ------------
 # Hata veren '/var/data' gibi yetki gerektiren yollardan kaçınmak için
 # her zaman botun kendi klasörünü kullanıyoruz.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "bot_state.sqlite")
+DB_PATH = os.environ.get("BOT_DB_PATH") or os.path.join(BASE_DIR, "bot_state.sqlite")
+
+# Tek, uzun ömürlü bağlantı. Bütün DB işleri tek bir worker thread'de sırayla
+# çalışır (run_db), böylece event loop diskte beklemez ve bağlantı paylaşımı güvenlidir.
+_db_con: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kargo-db")
 
 def db() -> sqlite3.Connection:
-    # check_same_thread=False asenkron bot için şart
-    con = sqlite3.connect(DB_PATH, check_same_thread=False)
-    con.row_factory = sqlite3.Row
-    return con
+    # `with db() as con:` commit/rollback yapar, bağlantıyı kapatmaz.
+    global _db_con
+    if _db_con is None:
+        with _db_lock:
+            if _db_con is None:
+                # check_same_thread=False: bağlantı init'te ana thread'de, sonra db thread'inde kullanılır.
+                # IMMEDIATE: yazma kilidi transaction başında alınır; birden fazla işçi süreç
+                # aynı dosyaya yazarken kilit yükseltme deadlock'u yerine busy_timeout kadar beklenir.
+                con = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=10,
+                                      isolation_level="IMMEDIATE")
+                con.row_factory = sqlite3.Row
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+                con.execute("PRAGMA busy_timeout=10000")
+                _db_con = con
+    return _db_con
+
+def _db_call(fn, args):
+    with db() as con:
+        return fn(con, *args)
+
+async def run_db(fn, *args):
+    """fn(con, *args) fonksiyonunu DB thread'inde tek transaction olarak çalıştırır."""
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_db_executor, _db_call, fn, args)
+    finally:
+        add_phase_time("sqlite", time.perf_counter() - t0)
+
+def close_db():
+    global _db_con
+    _db_executor.shutdown(wait=True)
+    if _db_con is not None:
+        _db_con.close()
+        _db_con = None
 
 def init_db():
     try:
@@ -77,15 +297,49 @@ def init_db():
                 company    TEXT,
                 created_at TEXT
             );
+            CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs(created_at);
+            -- /rapor için gün (BOT_TZ) x grup x firma bazında önceden toplanmış sayaçlar
+            CREATE TABLE IF NOT EXISTS daily_counts (
+                day        TEXT    NOT NULL,
+                chat_id    INTEGER NOT NULL,
+                company    TEXT    NOT NULL,
+                chat_title TEXT,
+                cnt        INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, chat_id, company)
+            ) WITHOUT ROWID;
+            -- Backend'e gönderilmeyi bekleyen /kargo blokları (update_id ile tekilleşir)
+            CREATE TABLE IF NOT EXISTS outbox (
+                update_id       INTEGER NOT NULL,
+                seq             INTEGER NOT NULL,
+                chat_id         INTEGER NOT NULL,
+                chat_title      TEXT,
+                reply_to        INTEGER,
+                total           INTEGER NOT NULL,
+                shipment        TEXT,
+                status          TEXT    NOT NULL DEFAULT 'pending',
+                attempts        INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL    NOT NULL DEFAULT 0,
+                result          TEXT,
+                replied         INTEGER NOT NULL DEFAULT 0,
+                created_at      TEXT,
+                PRIMARY KEY (update_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at);
+            -- Kısaltılmış takip linkleri; aynı link bir daha kısaltılmaz
+            CREATE TABLE IF NOT EXISTS short_urls (
+                long_url   TEXT PRIMARY KEY,
+                short_url  TEXT NOT NULL,
+                provider   TEXT,
+                created_at TEXT
+            );
             """)
+            backfill_daily_counts(con)
+        enable_incremental_vacuum(db())   # VACUUM transaction dışında çalışmalı
         log.info(f"Veritabanı başarıyla bağlandı: {DB_PATH}")
     except Exception as e:
         log.error(f"Kritik DB hatası: {e}")
         raise e
 
-# Bot ayağa kalkmadan önce DB'yi hazırla
-init_db()
-
 # ------------ HELPERS ------------
 def is_admin(user) -> bool:
     return (user and (user.username or "").lower() == ADMIN_USERNAME.lower())
@@ -93,11 +347,28 @@ def is_admin(user) -> bool:
 def chat_kind(chat: Chat) -> str:
     return chat.type
 
-def today_range_iso(tz: Optional[dt.tzinfo]=None):
-    now = dt.datetime.now(tz)
-    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    end   = start + dt.timedelta(days=1)
-    return start.isoformat(), end.isoformat()
+def shard_of(chat_id: int, count: int) -> int:
+    # SQL tarafında aynı ifade: abs(chat_id) % count
+    return abs(chat_id) % count
+
+def local_day(utc_naive: dt.datetime) -> str:
+    """logs.created_at biçimindeki (naive UTC) zamanı BOT_TZ'deki güne çevirir."""
+    return utc_naive.replace(tzinfo=dt.timezone.utc).astimezone(BOT_TZ).date().isoformat()
+
+def today_local() -> dt.date:
+    return dt.datetime.now(BOT_TZ).date()
+
+def parse_day(s: str) -> Optional[dt.date]:
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return dt.datetime.strptime(s.replace("/", "."), fmt).date()
+        except ValueError:
+            pass
+    return None
+
+def md_escape(s: str) -> str:
+    """MarkdownV2 özel karakterlerini kaçırır."""
+    return "".join("\\" + c if c in "_*[]()~`>#+-=|{}.!\\" else c for c in str(s))
 
 def get_group(con: sqlite3.Connection, chat_id: int):
     cur = con.execute("SELECT * FROM groups WHERE chat_id=?", (chat_id,))
@@ -110,9 +381,27 @@ def upsert_group(con: sqlite3.Connection, chat_id: int, title: str):
         ON CONFLICT(chat_id) DO UPDATE SET title=excluded.title, updated_at=excluded.updated_at
     """, (chat_id, title, dt.datetime.utcnow().isoformat()))
 
-def dec_quota(con: sqlite3.Connection, chat_id: int):
-    con.execute("UPDATE groups SET quota = quota - 1, updated_at=? WHERE chat_id=?",
-                (dt.datetime.utcnow().isoformat(), chat_id))
+def touch_group(con: sqlite3.Connection, chat_id: int, title: str):
+    upsert_group(con, chat_id, title)
+    return get_group(con, chat_id)
+
+def reserve_quota(con: sqlite3.Connection, chat_id: int, n: int = 1) -> Optional[int]:
+    """Tek statement ile n hak ayırır; yeterli hak yoksa veya grup kapalıysa None.
+    Başarılıysa kalan hakkı döner."""
+    row = con.execute("""
+        UPDATE groups SET quota = quota - ?, updated_at=?
+        WHERE chat_id=? AND disabled=0 AND quota >= ?
+        RETURNING quota
+    """, (n, dt.datetime.utcnow().isoformat(), chat_id, n)).fetchone()
+    return None if row is None else row["quota"]
+
+def refund_quota(con: sqlite3.Connection, chat_id: int, n: int = 1) -> int:
+    """reserve_quota ile ayrılan hakkı geri verir (API çağrısı başarısız olursa)."""
+    row = con.execute("""
+        UPDATE groups SET quota = quota + ?, updated_at=? WHERE chat_id=?
+        RETURNING quota
+    """, (n, dt.datetime.utcnow().isoformat(), chat_id)).fetchone()
+    return 0 if row is None else row["quota"]
 
 def set_quota(con: sqlite3.Connection, chat_id: int, title: str, quota: int):
     con.execute("""
@@ -129,37 +418,848 @@ def set_disabled(con: sqlite3.Connection, chat_id: int, title: str, disabled: bo
     """, (chat_id, title, 1 if disabled else 0, dt.datetime.utcnow().isoformat()))
 
 def log_create(con: sqlite3.Connection, chat_id: int, chat_title: str, item_id: str, company: str):
+    now = dt.datetime.utcnow()
     con.execute("""
         INSERT INTO logs(chat_id, chat_title, item_id, company, created_at)
         VALUES (?,?,?,?,?)
-    """, (chat_id, chat_title, item_id, company or "", dt.datetime.utcnow().isoformat()))
+    """, (chat_id, chat_title, item_id, company or "", now.isoformat()))
+    bump_daily_count(con, local_day(now), chat_id, chat_title, company or "")
+
+def bump_daily_count(con: sqlite3.Connection, day: str, chat_id: int, chat_title: str,
+                     company: str, n: int = 1):
+    con.execute("""
+        INSERT INTO daily_counts(day, chat_id, company, chat_title, cnt)
+        VALUES (?,?,?,?,?)
+        ON CONFLICT(day, chat_id, company) DO UPDATE SET
+            cnt = cnt + excluded.cnt, chat_title = excluded.chat_title
+    """, (day, chat_id, company, chat_title, n))
+
+def backfill_daily_counts(con: sqlite3.Connection):
+    """daily_counts tablosu yoksa/boşsa mevcut logs kayıtlarından bir kez doldurur."""
+    if con.execute("SELECT 1 FROM daily_counts LIMIT 1").fetchone():
+        return
+    counts = {}
+    for r in con.execute("SELECT chat_id, chat_title, company, created_at FROM logs ORDER BY id"):
+        try:
+            day = local_day(dt.datetime.fromisoformat(r["created_at"]))
+        except (TypeError, ValueError):
+            continue
+        key = (day, r["chat_id"], r["company"] or "")
+        cnt = counts.get(key, (None, 0))[1]
+        counts[key] = (r["chat_title"], cnt + 1)
+    con.executemany("""
+        INSERT INTO daily_counts(day, chat_id, company, chat_title, cnt) VALUES (?,?,?,?,?)
+    """, [(d, c, comp, title, n) for (d, c, comp), (title, n) in counts.items()])
+    if counts:
+        log.info(f"daily_counts {len(counts)} satırla dolduruldu")
+
+def enable_incremental_vacuum(con: sqlite3.Connection):
+    """auto_vacuum=INCREMENTAL yalnızca VACUUM ile etkinleşir; mevcut DB için bir kez yapılır."""
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        con.execute("VACUUM")
+        log.info("auto_vacuum=INCREMENTAL etkinleştirildi")
+
+def utc_bounds(start_day: dt.date, end_day: dt.date):
+    """[start_day, end_day] (BOT_TZ günleri) aralığını logs.created_at (naive UTC ISO) sınırlarına çevirir."""
+    def to_utc(d: dt.date) -> str:
+        local = dt.datetime.combine(d, dt.time.min, tzinfo=BOT_TZ)
+        return local.astimezone(dt.timezone.utc).replace(tzinfo=None).isoformat()
+    return to_utc(start_day), to_utc(end_day + dt.timedelta(days=1))
+
+def report_rows(con: sqlite3.Connection, start_day: str, end_day: str):
+    """[start_day, end_day] aralığı için (chat_id, chat_title, company, cnt) satırları.
+    Grup aralık içinde yeniden adlandırıldıysa en son günün başlığı kullanılır."""
+    # Tek geçiş: SQLite'ta MAX() ile birlikte seçilen chat_title, o (grup, firma)
+    # çiftinin en son gününe ait satırdan gelir; grup başına en yenisi burada seçilir.
+    rows = con.execute("""
+        SELECT chat_id, company, SUM(cnt) AS cnt, MAX(day) AS last_day, chat_title
+        FROM daily_counts
+        WHERE day >= ? AND day <= ?
+        GROUP BY chat_id, company
+    """, (start_day, end_day)).fetchall()
+    latest = {}
+    for r in rows:
+        if r["chat_id"] not in latest or r["last_day"] > latest[r["chat_id"]][0]:
+            latest[r["chat_id"]] = (r["last_day"], r["chat_title"])
+    return [{"chat_id": r["chat_id"], "chat_title": latest[r["chat_id"]][1],
+             "company": r["company"], "cnt": r["cnt"]} for r in rows]
+
+# Bot ayağa kalkmadan önce DB'yi hazırla
+init_db()
+
+# ------------ GROUP CACHE ------------
+# groups tablosunun süreç içi kopyası (chat_id -> satır). Okumalar buradan yapılır;
+# hak/durum değişiklikleri DB'ye anında yazılıp cache'e işlenir, başlık ve
+# updated_at ise _group_touches'ta biriktirilip flush_groups() ile toplu yazılır.
+_groups: dict = {}
+_group_touches: dict = {}   # chat_id -> (title, updated_at)
+
+def _cache_row(row) -> Optional[dict]:
+    if row is None:
+        return None
+    g = dict(row)
+    _groups[g["chat_id"]] = g
+    return g
+
+def _write_and_get(con: sqlite3.Connection, fn, chat_id: int, *args):
+    fn(con, chat_id, *args)
+    return get_group(con, chat_id)
+
+def flush_group_touches(con: sqlite3.Connection, items):
+    con.executemany("UPDATE groups SET title=?, updated_at=? WHERE chat_id=?", items)
+
+async def cached_group(chat_id: int, title: str) -> dict:
+    """Grubu cache'ten döner; ilk görüşte satırı oluşturup DB'den yükler."""
+    g = _groups.get(chat_id)
+    if g is None:
+        return _cache_row(await run_db(touch_group, chat_id, title))
+    g["title"] = title
+    _group_touches[chat_id] = (title, dt.datetime.utcnow().isoformat())
+    return g
+
+def _set_cached_quota(chat_id: int, quota: int):
+    if chat_id in _groups:
+        _groups[chat_id]["quota"] = quota
+
+async def current_quota(chat_id: int) -> int:
+    g = _groups.get(chat_id)
+    if g is None:
+        g = _cache_row(await run_db(get_group, chat_id))
+    return g["quota"] if g else 0
+
+async def update_group(fn, chat_id: int, *args) -> dict:
+    """set_quota / set_disabled gibi yazmaları anında uygular ve cache'i günceller."""
+    _group_touches.pop(chat_id, None)
+    return _cache_row(await run_db(_write_and_get, fn, chat_id, *args))
+
+async def flush_groups():
+    if not _group_touches:
+        return
+    items = [(title, ts, chat_id) for chat_id, (title, ts) in _group_touches.items()]
+    _group_touches.clear()
+    try:
+        await run_db(flush_group_touches, items)
+    except Exception as e:
+        log.error(f"Grup flush hatası: {e}")
+        for title, ts, chat_id in items:
+            _group_touches.setdefault(chat_id, (title, ts))
+
+async def group_flush_loop():
+    while True:
+        await asyncio.sleep(GROUP_FLUSH_INTERVAL)
+        await flush_groups()
+
+# ------------ HTTP ------------
+# main() içinde bir kez kurulur, kapanışta kapatılır. Handler'lar event loop'u
+# bloklamadan bu client üzerinden backend'e gider.
+http_client: Optional[httpx.AsyncClient] = None
+
+def build_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=API_BASE,
+        headers={"Authorization": f"Bearer {API_TOKEN}", "Content-Type": "application/json"},
+        limits=httpx.Limits(
+            max_connections=API_MAX_CONNECTIONS,
+            max_keepalive_connections=API_MAX_CONNECTIONS,
+        ),
+        # pool: bağlantı havuzu doluysa sırada bekleme süresi
+        timeout=httpx.Timeout(
+            connect=API_CONNECT_TIMEOUT,
+            read=API_READ_TIMEOUT,
+            write=API_CONNECT_TIMEOUT,
+            pool=API_READ_TIMEOUT,
+        ),
+    )
+
+class TrackingRejected(Exception):
+    """Backend isteği kalıcı olarak reddetti (4xx; 408 ve 429 hariç), tekrar denenmez."""
+
+async def create_tracking(payload: dict) -> Optional[dict]:
+    """POST /api/tracking; geçici hatalarda None döner, kalıcı redde TrackingRejected fırlatır."""
+    t0 = time.perf_counter()
+    try:
+        r = await http_client.post("/api/tracking", json=payload)
+        if r.status_code != 200:
+            log.warning(f"/api/tracking HTTP {r.status_code}")
+            API_FAILURES.inc(f"http_{r.status_code}")
+            if 400 <= r.status_code < 500 and r.status_code not in (408, 429):
+                raise TrackingRejected(r.status_code)
+            return None
+        return r.json()
+    except httpx.TimeoutException as e:
+        log.warning(f"/api/tracking zaman aşımı: {e!r}")
+        API_FAILURES.inc("timeout")
+        return None
+    except (httpx.HTTPError, ValueError) as e:
+        log.warning(f"/api/tracking hatası: {e!r}")
+        API_FAILURES.inc("error")
+        return None
+    finally:
+        COMMAND_SECONDS.observe(time.perf_counter() - t0, _metric_cmd.get(), "backend")
+
+# ------------ SHORTENER ------------
+# SHORTENER_ORDER sırasıyla, hedge'lenerek link kısaltma. Sonuçlar short_urls
+# tablosunda kalıcı olarak saklanır. Sağlayıcı başına ayrı zaman aşımı ve devre
+# kesici vardır; kısaltma başarısız olursa uzun link kullanılır.
+def _parse_cleanuri(r: httpx.Response) -> str:
+    return r.json()["result_url"]
+
+def _parse_text(r: httpx.Response) -> str:
+    return r.text.strip()
+
+# ad -> (method, endpoint, url parametresinin gönderilme şekli, cevap parser'ı)
+SHORTENERS = {
+    "cleanuri": ("POST", "https://cleanuri.com/api/v1/shorten", "data", _parse_cleanuri),
+    "isgd":     ("GET", "https://is.gd/create.php?format=simple", "params", _parse_text),
+    "tinyurl":  ("GET", "https://tinyurl.com/api-create.php", "params", _parse_text),
+}
+
+# Üçüncü taraf servislere API_TOKEN sızmasın diye ayrı client'lar. Her sağlayıcının
+# kendi bağlantı havuzu var: yavaş bir sağlayıcı havuzu doldurunca hedge'lenen
+# sıradaki sağlayıcı onun arkasında beklemez.
+shortener_clients: dict = {}  # sağlayıcı -> httpx.AsyncClient
+_breakers: dict = {}          # sağlayıcı -> {"failures": n, "open_until": t}
+_shorten_inflight: dict = {}  # long_url -> Task (aynı link için tek istek)
+
+def build_shortener_clients() -> dict:
+    return {
+        name: httpx.AsyncClient(
+            timeout=httpx.Timeout(SHORTENER_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=SHORTENER_MAX_CONNECTIONS,
+                max_keepalive_connections=SHORTENER_MAX_CONNECTIONS,
+            ),
+            follow_redirects=True,
+        )
+        for name in SHORTENERS
+    }
+
+def get_short_url(con: sqlite3.Connection, long_url: str) -> Optional[str]:
+    row = con.execute("SELECT short_url FROM short_urls WHERE long_url=?", (long_url,)).fetchone()
+    return row["short_url"] if row else None
+
+def save_short_url(con: sqlite3.Connection, long_url: str, short_url: str, provider: str):
+    con.execute("""
+        INSERT OR IGNORE INTO short_urls(long_url, short_url, provider, created_at) VALUES (?,?,?,?)
+    """, (long_url, short_url, provider, dt.datetime.utcnow().isoformat()))
+
+def _breaker_open(name: str) -> bool:
+    b = _breakers.get(name)
+    return b is not None and b["open_until"] > time.monotonic()
+
+def _breaker_record(name: str, ok: bool):
+    b = _breakers.setdefault(name, {"failures": 0, "open_until": 0.0})
+    if ok:
+        b["failures"] = 0
+        return
+    b["failures"] += 1
+    if b["failures"] >= SHORTENER_BREAKER_FAILURES:
+        # Devre açık; süre dolunca tek deneme hakkı (half-open) verilir
+        b["open_until"] = time.monotonic() + SHORTENER_BREAKER_COOLDOWN
+        b["failures"] = SHORTENER_BREAKER_FAILURES - 1
+        log.warning(f"Kısaltıcı {name} {SHORTENER_BREAKER_COOLDOWN:.0f}s devre dışı")
+
+async def _call_shortener(name: str, long_url: str) -> Optional[str]:
+    method, endpoint, how, parse = SHORTENERS[name]
+    t0 = time.perf_counter()
+    try:
+        r = await shortener_clients[name].request(method, endpoint, **{how: {"url": long_url}})
+        r.raise_for_status()
+        short = parse(r)
+        if not short.startswith("http"):
+            raise ValueError(f"geçersiz cevap: {short[:60]!r}")
+    except asyncio.CancelledError:
+        raise
+    except httpx.PoolTimeout:
+        # Bu sağlayıcının havuzu bizde dolu; sağlayıcının suçu değil, devre kesiciye yazılmaz
+        SHORTENER_CALLS.inc(name, "pool_timeout")
+        return None
+    except Exception as e:
+        log.warning(f"Kısaltıcı {name} hatası: {e!r}")
+        _breaker_record(name, False)
+        SHORTENER_CALLS.inc(name, "error")
+        return None
+    finally:
+        COMMAND_SECONDS.observe(time.perf_counter() - t0, _metric_cmd.get(), "shortener")
+    _breaker_record(name, True)
+    SHORTENER_CALLS.inc(name, "ok")
+    return short
+
+async def _shorten_hedged(long_url: str):
+    """Sağlayıcıları sırayla, hedge gecikmesiyle başlatır; ilk başarılı (ad, kısa_link)."""
+    providers = [n for n in SHORTENER_ORDER if n in shortener_clients and not _breaker_open(n)]
+    pending: dict = {}
+    try:
+        for i, name in enumerate(providers):
+            pending[asyncio.create_task(_call_shortener(name, long_url))] = name
+            last = i == len(providers) - 1
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=None if last else SHORTENER_HEDGE_DELAY,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    break       # hedge süresi doldu, sıradaki sağlayıcıyı da başlat
+                for t in done:
+                    provider = pending.pop(t)
+                    if t.result():
+                        return provider, t.result()
+                # biten(ler) başarısız: bekleyen yoksa hemen sıradakine geç
+    finally:
+        for t in pending:
+            t.cancel()
+    return None
+
+async def _shorten_and_store(long_url: str) -> Optional[str]:
+    try:
+        res = await _shorten_hedged(long_url)
+        if res is None:
+            return None
+        provider, short = res
+        await run_db(save_short_url, long_url, short, provider)
+        return short
+    finally:
+        _shorten_inflight.pop(long_url, None)
+
+async def shorten_url(long_url: str) -> str:
+    """Kısa linki döner; SHORTENER_BUDGET içinde alınamazsa uzun linki döner.
+    Bütçe aşılsa da kısaltma arka planda sürer ve sonraki çağrılar için saklanır."""
+    if not SHORTENER_ORDER or not shortener_clients:
+        return long_url
+    cached = await run_db(get_short_url, long_url)
+    if cached:
+        return cached
+    task = _shorten_inflight.get(long_url)
+    if task is None:
+        task = _shorten_inflight[long_url] = asyncio.create_task(_shorten_and_store(long_url))
+    try:
+        short = await asyncio.wait_for(asyncio.shield(task), timeout=SHORTENER_BUDGET)
+    except asyncio.TimeoutError:
+        return long_url
+    except Exception as e:
+        log.warning(f"Kısaltma hatası: {e!r}")
+        return long_url
+    return short or long_url
+
+# ------------ OUTBOUND ------------
+# Handler'lar mesajı doğrudan göndermez, reply() ile kuyruğa bırakıp döner.
+# ReplyScheduler öncelik sırasına göre, sohbet başına ve global token bucket
+# limitlerine uyarak gönderir; RetryAfter gelirse bekleyip tekrar dener.
+PRIO_HIGH, PRIO_NORMAL, PRIO_LOW = 0, 1, 2   # hak/hata mesajları < kargo < rapor
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def take(self) -> float:
+        """Token varsa alır ve 0 döner; yoksa beklenmesi gereken süreyi döner."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while (wait := self.take()) > 0:
+            await asyncio.sleep(wait)
+
+def split_text(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> list:
+    """Uzun mesajı satır sınırlarından bölerek limit altındaki parçalara ayırır."""
+    parts, cur = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if cur:
+                parts.append(cur)
+                cur = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if cur and len(cur) + 1 + len(line) > limit:
+            parts.append(cur)
+            cur = line
+        else:
+            cur = f"{cur}\n{line}" if cur else line
+    if cur or not parts:
+        parts.append(cur)
+    return parts
+
+class ReplyScheduler:
+    def __init__(self, bot, senders: int = TG_SENDERS):
+        self.bot = bot
+        self.senders = senders
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.global_bucket = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        self.chat_buckets: dict = {}
+        self.busy_chats: set = set()
+        self._seq = itertools.count()
+        self._workers: list = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.senders)]
+
+    async def stop(self, drain_timeout: float = 5):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Gönderilemeyen {self.queue.qsize()} mesaj bırakıldı")
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, chat_id: int, calls: list, priority: int = PRIO_NORMAL) -> asyncio.Future:
+        """calls: [(bot_method_adı, kwargs), ...] sırayla gönderilir. Dönen future
+        ilk çağrının sonucunu (ör. gönderilen Message) taşır; hata olursa None."""
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self._seq), chat_id, calls, fut, _metric_cmd.get()))
+        return fut
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        b = self.chat_buckets.get(chat_id)
+        if b is None:
+            b = self.chat_buckets[chat_id] = TokenBucket(TG_CHAT_PER_MINUTE / 60, TG_CHAT_BURST)
+        return b
+
+    def _defer(self, delay: float, item):
+        # Sohbet limiti dolu: worker'ı meşgul etmeden öğeyi sonra tekrar kuyruğa koy.
+        # task_done yeniden koyduktan sonra çağrılır ki queue.join() erken dönmesin.
+        def requeue():
+            self.queue.put_nowait(item)
+            self.queue.task_done()
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            priority, seq, chat_id, calls, fut, command = item
+            if chat_id in self.busy_chats:
+                self._defer(0.05, item)
+                continue
+            wait = self._chat_bucket(chat_id).take()
+            if wait > 0:
+                self._defer(wait, item)
+                continue
+            self.busy_chats.add(chat_id)
+            try:
+                result = None
+                for i, (method, kwargs) in enumerate(calls):
+                    if i:
+                        await self._chat_bucket(chat_id).acquire()
+                    await self.global_bucket.acquire()
+                    t0 = time.perf_counter()
+                    try:
+                        r = await self._call(method, kwargs)
+                    finally:
+                        COMMAND_SECONDS.observe(time.perf_counter() - t0, command, "telegram")
+                    if i == 0:
+                        result = r
+                if not fut.done():
+                    fut.set_result(result)
+            except Exception as e:
+                log.warning(f"Telegram gönderim hatası (chat {chat_id}): {e!r}")
+                if not fut.done():
+                    fut.set_result(None)
+            finally:
+                self.busy_chats.discard(chat_id)
+                self.queue.task_done()
+
+    async def _call(self, method: str, kwargs: dict, attempts: int = 5):
+        for attempt in range(attempts):
+            try:
+                return await getattr(self.bot, method)(**kwargs)
+            except RetryAfter as e:
+                wait = float(getattr(e.retry_after, "total_seconds", lambda: e.retry_after)())
+                log.warning(f"Telegram RetryAfter: {wait}s")
+                self.global_bucket.block(wait)
+                await asyncio.sleep(wait)
+            except BadRequest:
+                raise   # NetworkError alt sınıfı ama kalıcı: tekrar denemek işe yaramaz
+            except (TimedOut, NetworkError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 10))
+        raise RuntimeError(f"{method} {attempts} denemede gönderilemedi")
+
+sender: Optional[ReplyScheduler] = None
+
+def send_text(chat_id: int, text: str, priority: int = PRIO_NORMAL, reply_to: Optional[int] = None,
+              parse_mode: Optional[str] = None) -> asyncio.Future:
+    calls = []
+    for part in split_text(text):
+        kwargs = {"chat_id": chat_id, "text": part, "parse_mode": parse_mode}
+        if reply_to is not None and not calls:
+            kwargs["reply_parameters"] = ReplyParameters(message_id=reply_to, allow_sending_without_reply=True)
+        calls.append(("send_message", kwargs))
+    return sender.submit(chat_id, calls, priority)
+
+def reply(update: Update, text: str, priority: int = PRIO_NORMAL, markdown: bool = False) -> asyncio.Future:
+    """Mesaja cevabı kuyruğa bırakır ve hemen döner."""
+    return send_text(
+        update.effective_chat.id, text, priority,
+        reply_to=update.message.message_id if update.message else None,
+        parse_mode=ParseMode.MARKDOWN_V2 if markdown else None,
+    )
+
+# ------------ OUTBOX ------------
+# kargo() yalnızca hakkı ayırıp blokları outbox tablosuna yazar ve döner. outbox_loop
+# vadesi gelen satırları kiralayıp en fazla OUTBOX_CONCURRENCY tanesini (API bağlantı
+# havuzunu aşmadan) aynı anda backend'e gönderir; yavaş bir satır diğerlerini bekletmez.
+# Backend'in kalıcı reddi (4xx) tekrar denenmeden başarısız sayılır. Geçici hatalar üstel geri
+# çekilmeyle yeniden denenir; bir mesajın bütün blokları sonuçlanınca cevap verilir.
+outbox_wakeup = asyncio.Event()
+outbox_acks: dict = {}      # update_id -> "hazırlanıyor" mesajının future'ı
+_final_tasks: set = set()
+
+def enqueue_kargo(con: sqlite3.Connection, update_id: int, chat_id: int, chat_title: str,
+                  reply_to: Optional[int], shipments: list):
+    """Hakkı ayırır ve blokları outbox'a yazar. (durum, kalan_hak) döner;
+    durum: ok | duplicate | disabled | no_quota. Tekrar gelen update, hak ve
+    durum kontrollerinden önce ayıklanır."""
+    if con.execute("SELECT 1 FROM outbox WHERE update_id=? LIMIT 1", (update_id,)).fetchone():
+        g = get_group(con, chat_id)
+        return "duplicate", g["quota"] if g else 0
+    need = sum(1 for s in shipments if s is not None)
+    left = reserve_quota(con, chat_id, need)
+    if left is None:
+        g = get_group(con, chat_id)
+        if g and g["disabled"]:
+            return "disabled", g["quota"]
+        return "no_quota", g["quota"] if g else 0
+    now = dt.datetime.utcnow().isoformat()
+    con.executemany("""
+        INSERT INTO outbox(update_id, seq, chat_id, chat_title, reply_to, total, shipment, status, created_at)
+        VALUES (?,?,?,?,?,?,?,?,?)
+    """, [
+        (update_id, i, chat_id, chat_title, reply_to, len(shipments),
+         None if s is None else json.dumps(s, ensure_ascii=False),
+         "invalid" if s is None else "pending", now)
+        for i, s in enumerate(shipments)
+    ])
+    return "ok", left
+
+def claim_outbox(con: sqlite3.Connection, now: float, limit: int):
+    """Vadesi gelen satırları OUTBOX_LEASE süreliğine kiralayıp (next_attempt_at ileri
+    alınır) döner; böylece işlenirken bir daha seçilmezler."""
+    return con.execute("""
+        UPDATE outbox SET next_attempt_at = ?
+        WHERE rowid IN (
+            SELECT rowid FROM outbox WHERE status='pending' AND next_attempt_at <= ?
+              AND abs(chat_id) % ? = ?
+            ORDER BY next_attempt_at, update_id, seq LIMIT ?
+        )
+        RETURNING *
+    """, (now + OUTBOX_LEASE, now, WORKER_COUNT, WORKER_INDEX, limit)).fetchall()
+
+def release_outbox(con: sqlite3.Connection, keys: list):
+    """Kapanışta yarıda kalan satırların kirasını bırakır."""
+    con.executemany("UPDATE outbox SET next_attempt_at=0 WHERE update_id=? AND seq=? AND status='pending'", keys)
+
+def next_outbox_due(con: sqlite3.Connection) -> Optional[float]:
+    row = con.execute("SELECT MIN(next_attempt_at) AS t FROM outbox WHERE status='pending' AND abs(chat_id) % ? = ?",
+                      (WORKER_COUNT, WORKER_INDEX)).fetchone()
+    return row["t"]
+
+def apply_outbox_results(con: sqlite3.Connection, done: list, retry: list, failed: list) -> dict:
+    """Bir turun sonuçlarını yazar; başarılar loglanır, kesin başarısızların hakkı iade
+    edilir. İade sonrası grupların kalan hakkını döner."""
+    for row, data in done:
+        con.execute("UPDATE outbox SET status='done', attempts=attempts+1, result=? WHERE update_id=? AND seq=?",
+                    (json.dumps(data, ensure_ascii=False), row["update_id"], row["seq"]))
+        log_create(con, row["chat_id"], row["chat_title"], data.get("id",""),
+                   json.loads(row["shipment"])["company"])
+    con.executemany("UPDATE outbox SET attempts=attempts+1, next_attempt_at=? WHERE update_id=? AND seq=?",
+                    [(t, row["update_id"], row["seq"]) for row, t in retry])
+    con.executemany("UPDATE outbox SET status='failed', attempts=attempts+1 WHERE update_id=? AND seq=?",
+                    [(row["update_id"], row["seq"]) for row in failed])
+    refunds = {}
+    for row in failed:
+        refunds[row["chat_id"]] = refunds.get(row["chat_id"], 0) + 1
+    return {chat_id: refund_quota(con, chat_id, n) for chat_id, n in refunds.items()}
+
+def unreplied_outbox(con: sqlite3.Connection, update_ids: Optional[list] = None) -> list:
+    """Bütün blokları sonuçlanmış ama henüz cevaplanmamış mesajların satırlarını
+    replied=1 işaretleyip döner (en fazla bir kez cevap)."""
+    if update_ids is None:
+        update_ids = [r["update_id"] for r in con.execute("""
+            SELECT update_id FROM outbox WHERE replied=0 AND abs(chat_id) % ? = ?
+            GROUP BY update_id HAVING SUM(status='pending')=0
+        """, (WORKER_COUNT, WORKER_INDEX))]
+    out = []
+    for uid in update_ids:
+        rows = con.execute("SELECT * FROM outbox WHERE update_id=? ORDER BY seq", (uid,)).fetchall()
+        if not rows or rows[0]["replied"] or any(r["status"] == "pending" for r in rows):
+            continue
+        con.execute("UPDATE outbox SET replied=1 WHERE update_id=?", (uid,))
+        out.append(rows)
+    return out
+
+def settle_outbox(con: sqlite3.Connection, done: list, retry: list, failed: list, update_ids: list):
+    """Sonuçları yazar ve artık cevaplanabilecek mesajları döner: (kalan haklar, gruplar)."""
+    return apply_outbox_results(con, done, retry, failed), unreplied_outbox(con, update_ids)
+
+def outbox_backoff(attempts: int) -> float:
+    delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * (2 ** attempts))
+    return delay * random.uniform(0.5, 1.0)
+
+# İşlenmekte olan satırlar: (update_id, seq) -> task. Her satır kendi task'ında
+# sonuçlanır; biten her iş yerini hemen vadesi gelen yeni bir satıra bırakır.
+# Aynı anda biten işlerin sonuçları tek transaction'da yazılır (_outbox_settle).
+_outbox_jobs: dict = {}
+_settle_batch: Optional[dict] = None
+
+async def _flush_settle(batch: dict):
+    global _settle_batch
+    await asyncio.sleep(0)   # aynı turda biten diğer işler de eklensin
+    _settle_batch = None
+    try:
+        lefts, finished = await run_db(settle_outbox, batch["done"], batch["retry"], batch["failed"],
+                                       sorted(batch["update_ids"]))
+    except Exception as e:
+        batch["fut"].set_exception(e)
+        return
+    batch["fut"].set_result(None)
+    for chat_id, left in lefts.items():
+        _set_cached_quota(chat_id, left)
+    for group in finished:
+        t = asyncio.create_task(deliver_outbox_reply(group))
+        _final_tasks.add(t)
+        t.add_done_callback(_final_tasks.discard)
+
+async def _outbox_settle(row, data: Optional[dict], retry_at: Optional[float]):
+    """Satırın sonucunu sıradaki toplu yazmaya ekler ve yazılana kadar bekler."""
+    global _settle_batch
+    batch = _settle_batch
+    if batch is None:
+        batch = _settle_batch = {"done": [], "retry": [], "failed": [], "update_ids": set(),
+                                 "fut": asyncio.get_running_loop().create_future()}
+        t = asyncio.create_task(_flush_settle(batch))
+        _final_tasks.add(t)   # kapanışta yarıda kalmasın
+        t.add_done_callback(_final_tasks.discard)
+    if data is not None:
+        batch["done"].append((row, data))
+    elif retry_at is not None:
+        batch["retry"].append((row, retry_at))
+    else:
+        batch["failed"].append(row)
+    batch["update_ids"].add(row["update_id"])
+    await asyncio.shield(batch["fut"])
+
+async def _outbox_job(row):
+    with timed("outbox"):
+        try:
+            data = await create_tracking(shipment_payload(json.loads(row["shipment"])))
+        except TrackingRejected:
+            data, rejected = None, True
+        else:
+            rejected = False
+        retry_at = None
+        if data is None and not rejected and row["attempts"] + 1 < OUTBOX_MAX_ATTEMPTS:
+            retry_at = time.time() + outbox_backoff(row["attempts"])
+            log.warning(f"Outbox: {row['update_id']}/{row['seq']} tekrar denenecek")
+        await _outbox_settle(row, data, retry_at)
+
+def _outbox_job_done(key, task: asyncio.Task):
+    _outbox_jobs.pop(key, None)
+    if not task.cancelled() and task.exception() is not None:
+        log.error(f"Outbox işi hatası ({key[0]}/{key[1]}): {task.exception()!r}")
+    outbox_wakeup.set()   # boşalan yer için sıradaki satır
+
+def outbox_capacity() -> int:
+    # Havuzdaki bağlantıdan fazla istek yalnızca havuzda bekler (ve kira süresini yer)
+    return max(1, min(OUTBOX_CONCURRENCY, API_MAX_CONNECTIONS))
+
+async def outbox_dispatch() -> int:
+    """Boş iş yeri kadar vadesi gelen satırı kiralayıp işlemeye başlar; kiralanan satır sayısını döner."""
+    free = outbox_capacity() - len(_outbox_jobs)
+    if free <= 0:
+        return 0
+    rows = await run_db(claim_outbox, time.time(), min(free, OUTBOX_BATCH))
+    for row in rows:
+        key = (row["update_id"], row["seq"])
+        if key in _outbox_jobs:   # kirası dolmuş ama hâlâ süren istek; yalnızca kira uzadı
+            continue
+        t = asyncio.create_task(_outbox_job(row))
+        _outbox_jobs[key] = t
+        t.add_done_callback(functools.partial(_outbox_job_done, key))
+    return len(rows)
+
+async def deliver_outbox_reply(rows: list):
+    first = rows[0]
+    chat_id, update_id = first["chat_id"], first["update_id"]
+    shipments = [None if r["shipment"] is None else json.loads(r["shipment"]) for r in rows]
+    results = [json.loads(r["result"]) if r["status"] == "done" else None for r in rows]
+    left = await current_quota(chat_id)
+    # Kısaltmalar paralel; her biri en fazla SHORTENER_BUDGET bekletir
+    shown = await asyncio.gather(*(
+        shorten_url(tracking_url(d)) if d is not None else asyncio.sleep(0) for d in results
+    ))
+    if len(rows) == 1:
+        if results[0] is None:
+            text, prio = "Sunucuya ulaşılamadı veya hata oluştu.", PRIO_HIGH
+        else:
+            text, prio = kargo_message(shipments[0], results[0], left, shown[0]), PRIO_NORMAL
+    else:
+        text, prio = kargo_batch_message(shipments, results, left, shown), PRIO_NORMAL
+
+    # Önce "hazırlanıyor" mesajını düzenlemeyi dene; olmazsa yeni mesaj gönder.
+    ack = outbox_acks.pop(update_id, None)
+    msg = await ack if ack is not None else None
+    if msg is not None and len(text) <= MessageLimit.MAX_TEXT_LENGTH:
+        edited = await sender.submit(chat_id, [("edit_message_text", {
+            "chat_id": chat_id, "message_id": msg.message_id, "text": text,
+        })], prio)
+        if edited is not None:
+            return
+    send_text(chat_id, text, prio, reply_to=first["reply_to"])
+
+async def outbox_loop():
+    # Önceki çalışmadan cevapsız kalmış sonuçlanmış mesajlar
+    for group in await run_db(unreplied_outbox):
+        await deliver_outbox_reply(group)
+    try:
+        while True:
+            try:
+                # Arada gelen yeni kayıtlar ve biten işler event'i yeniden set eder
+                outbox_wakeup.clear()
+                if await outbox_dispatch():
+                    continue
+                if len(_outbox_jobs) >= outbox_capacity():
+                    timeout = None   # bir iş bitince uyanılır
+                else:
+                    nxt = await run_db(next_outbox_due)
+                    timeout = None if nxt is None else max(0.0, nxt - time.time())
+                try:
+                    await asyncio.wait_for(outbox_wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Outbox hatası: {e!r}")
+                await asyncio.sleep(5)
+    finally:
+        jobs = list(_outbox_jobs.items())
+        for _, t in jobs:
+            t.cancel()
+        await asyncio.gather(*(t for _, t in jobs), return_exceptions=True)
+        cancelled = [key for key, t in jobs if t.cancelled()]
+        if cancelled:
+            await run_db(release_outbox, cancelled)
+
+# ------------ RETENTION ------------
+# Ham logs satırlarının günlük özeti daily_counts'ta zaten artımlı tutulur; bu iş
+# LOG_RETENTION_DAYS'ten eski ham satırları küçük gruplar halinde siler (her grup
+# ayrı bir DB çağrısı, arada diğer işler çalışır) ve ardından boş sayfaları
+# incremental_vacuum ile geri verir.
+def delete_old_logs(con: sqlite3.Connection, cutoff_iso: str, limit: int) -> int:
+    return con.execute("""
+        DELETE FROM logs WHERE id IN (
+            SELECT id FROM logs WHERE created_at < ? ORDER BY created_at LIMIT ?
+        )
+    """, (cutoff_iso, limit)).rowcount
+
+def delete_old_outbox(con: sqlite3.Connection, cutoff_iso: str, limit: int) -> int:
+    return con.execute("""
+        DELETE FROM outbox WHERE rowid IN (
+            SELECT rowid FROM outbox WHERE replied=1 AND created_at < ? LIMIT ?
+        )
+    """, (cutoff_iso, limit)).rowcount
+
+def incremental_vacuum(con: sqlite3.Connection, pages: int) -> int:
+    con.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return con.execute("PRAGMA freelist_count").fetchone()[0]
+
+async def _delete_in_batches(fn, cutoff: dt.datetime) -> int:
+    total = 0
+    while True:
+        n = await run_db(fn, cutoff.isoformat(), RETENTION_BATCH)
+        total += n
+        if n < RETENTION_BATCH:
+            return total
+        await asyncio.sleep(0.05)
+
+async def run_retention() -> int:
+    now = dt.datetime.utcnow()
+    removed = await _delete_in_batches(delete_old_logs, now - dt.timedelta(days=LOG_RETENTION_DAYS))
+    removed_outbox = await _delete_in_batches(delete_old_outbox, now - dt.timedelta(days=OUTBOX_RETENTION_DAYS))
+    if removed or removed_outbox:
+        log.info(f"Retention: {removed} log, {removed_outbox} outbox satırı silindi")
+        while await run_db(incremental_vacuum, RETENTION_BATCH) > 0:
+            await asyncio.sleep(0.05)
+    return removed
+
+async def retention_loop():
+    await asyncio.sleep(60)
+    while True:
+        try:
+            await run_retention()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error(f"Retention hatası: {e!r}")
+        await asyncio.sleep(RETENTION_INTERVAL_HOURS * 3600)
+
+_bg_tasks: list = []
+
+async def on_startup(app: Application):
+    global http_client, shortener_clients, sender
+    http_client = build_http_client()
+    shortener_clients = build_shortener_clients()
+    sender = ReplyScheduler(app.bot)
+    sender.start()
+    _bg_tasks.append(asyncio.create_task(group_flush_loop()))
+    _bg_tasks.append(asyncio.create_task(outbox_loop()))
+    if WORKER_INDEX == 0:   # retention ortak tabloları temizler, tek süreç yeter
+        _bg_tasks.append(asyncio.create_task(retention_loop()))
+
+async def on_shutdown(app: Application):
+    global http_client, shortener_clients, sender
+    for t in _bg_tasks:
+        t.cancel()
+    await asyncio.gather(*_bg_tasks, return_exceptions=True)
+    _bg_tasks.clear()
+    if _final_tasks:
+        await asyncio.wait(_final_tasks, timeout=5)
+    await flush_groups()
+    if sender is not None:
+        await sender.stop()
+        sender = None
+    for t in list(_shorten_inflight.values()):
+        t.cancel()
+    clients, shortener_clients = shortener_clients, {}
+    await asyncio.gather(*(c.aclose() for c in clients.values()))
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    close_db()
 
 # ------------ COMMANDS ------------
 async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if chat_kind(update.effective_chat) == "private":
-        await update.message.reply_text("Lütfen @CengizzAtay ile iletişime geçin.")
+        reply(update, "Lütfen @CengizzAtay ile iletişime geçin.", PRIO_HIGH)
         return
-    await update.message.reply_text(
+    reply(update,
         "Selam! /kargo komutunu şu formatta tek mesajda gönder:\n\n"
-        "/kargo\nAd Soyad\nAdres\nTarih\nFirma Adı"
+        "/kargo\nAd Soyad\nAdres\nTarih\nFirma Adı\n\n"
+        "Birden fazla kargo için her birini aynı mesajda boş bir satırla ayırabilirsin."
     )
 
 async def dm_guard(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if chat_kind(update.effective_chat) == "private":
-        await update.message.reply_text("Lütfen @CengizzAtay ile iletişime geçin.")
-
-async def kargo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    chat = update.effective_chat
-    if chat_kind(chat) == "private":
-        await update.message.reply_text("Lütfen @CengizzAtay ile iletişime geçin.")
-        return
-
-    text = (update.message.text or "").splitlines()
-    lines = [l.strip() for l in text[1:] if l.strip()]
-    if len(lines) < 4:
-        await update.message.reply_text("Format:\n/kargo\nAd Soyad\nAdres\nTarih\nFirma Adı")
-        return
+        reply(update, "Lütfen @CengizzAtay ile iletişime geçin.", PRIO_HIGH)
 
+def parse_shipment(lines: list) -> dict:
     full_name, address, eta_str, company = lines[0], lines[1], lines[2], lines[3]
     api_eta = eta_str
     try:
@@ -167,71 +1267,125 @@ async def kargo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         api_eta = parsed_date.strftime("%Y-%m-%d")
     except ValueError:
         pass
+    return {"full_name": full_name, "address": address, "eta_str": eta_str,
+            "api_eta": api_eta, "company": company}
 
-    with db() as con:
-        upsert_group(con, chat.id, chat.title or str(chat.id))
-        g = get_group(con, chat.id)
-        if g["disabled"]:
-            await update.message.reply_text("Bu grupta işlemler kapalıdır. Lütfen @CengizzAtay yazınız.")
-            return
-        if g["quota"] <= 0:
-            await update.message.reply_text("Hakkınız yoktur. Lütfen @CengizzAtay yaz.")
-            return
+def parse_kargo_text(text: str) -> list:
+    """/kargo mesajını gönderilere ayırır. Boş satırla ayrılmış her blok bir gönderidir;
+    4 satırdan oluşmayan bloklar None olarak döner. Tek blokluk mesajlarda eski
+    davranış korunur (ilk 4 satır)."""
+    blocks, cur = [], []
+    for l in text.splitlines()[1:]:
+        if l.strip():
+            cur.append(l.strip())
+        elif cur:
+            blocks.append(cur)
+            cur = []
+    if cur:
+        blocks.append(cur)
 
-    try:
-        payload = {
-            "full_name": full_name,
-            "address": address,
-            "eta": api_eta,
-            "company": company,
-            "carrier": "yurtici"
-        }
-        r = requests.post(
-            f"{API_BASE}/api/tracking",
-            json=payload,
-            headers={"Authorization": f"Bearer {API_TOKEN}", "Content-Type":"application/json"},
-            timeout=15
-        )
-        if r.status_code != 200:
-            await update.message.reply_text("Sunucuya ulaşılamadı veya hata oluştu.")
-            return
-        data = r.json()
-    except Exception:
-        await update.message.reply_text("Sunucuya ulaşılamadı veya hata oluştu.")
-        return
+    if len(blocks) <= 1 or sum(len(b) for b in blocks) == 4:
+        lines = [l for b in blocks for l in b]
+        return [parse_shipment(lines)] if len(lines) >= 4 else []
+    return [parse_shipment(b) if len(b) == 4 else None for b in blocks]
 
-    with db() as con:
-        dec_quota(con, chat.id)
-        log_create(con, chat.id, chat.title or str(chat.id), data.get("id",""), company)
-        left = con.execute("SELECT quota FROM groups WHERE chat_id=?", (chat.id,)).fetchone()["quota"]
+def shipment_payload(s: dict) -> dict:
+    return {
+        "full_name": s["full_name"],
+        "address": s["address"],
+        "eta": s["api_eta"],
+        "company": s["company"],
+        "carrier": "yurtici"
+    }
 
-    url = data.get("url", f"{API_BASE}/t/{data.get('id','')}")
-    shown_url = url
-    track_id = data.get("id","")
+def tracking_url(data: dict) -> str:
+    return data.get("url", f"{API_BASE}/t/{data.get('id','')}")
 
-    msg = (
+def kargo_message(s: dict, data: dict, left: int, shown_url: Optional[str] = None) -> str:
+    shown_url = shown_url or tracking_url(data)
+    track_id = data.get("id","")
+    return (
         "Kargo Takip Sitesi hazır:\n\n"
         f"{shown_url}\n\n"
         f"Kalan Hak : {left}\n\n"
         "Müşteriye Gönderilecek Örnek Mesaj :\n\n"
-        f"Merhaba {full_name}. Ürünleriniz kargoya verilmiştir. Aşağıdaki linkten direkt kargonuzu sorgulayabilirsiniz.\n"
+        f"Merhaba {s['full_name']}. Ürünleriniz kargoya verilmiştir. Aşağıdaki linkten direkt kargonuzu sorgulayabilirsiniz.\n"
         f"Kargo Takip Numarası : {track_id}\n"
         "Kargo Takip Sitesi : \n"
         f"{shown_url}\n"
-        f"Tahmini Teslim Süresi : {eta_str}"
+        f"Tahmini Teslim Süresi : {s['eta_str']}"
     )
-    await update.message.reply_text(msg)
+
+def kargo_batch_message(shipments: list, results: list, left: int, shown_urls: Optional[list] = None) -> str:
+    ok = sum(1 for d in results if d is not None)
+    lines = [f"{ok}/{len(shipments)} Kargo Takip Sitesi hazır:\n"]
+    shown_urls = shown_urls or [None] * len(results)
+    for i, (s, data, shown) in enumerate(zip(shipments, results, shown_urls), 1):
+        if s is None:
+            lines.append(f"{i}. ❌ Hatalı format (4 satır olmalı)")
+        elif data is None:
+            lines.append(f"{i}. ❌ {s['full_name']} — Sunucuya ulaşılamadı")
+        else:
+            lines.append(f"{i}. {s['full_name']} — {shown or tracking_url(data)}")
+    lines.append(f"\nKalan Hak : {left}")
+    return "\n".join(lines)
+
+async def kargo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    if chat_kind(chat) == "private":
+        reply(update, "Lütfen @CengizzAtay ile iletişime geçin.", PRIO_HIGH)
+        return
+
+    shipments = parse_kargo_text(update.message.text or "")
+    valid = [s for s in shipments if s is not None]
+    if not valid:
+        reply(update, "Format:\n/kargo\nAd Soyad\nAdres\nTarih\nFirma Adı", PRIO_HIGH)
+        return
+    if len(shipments) > KARGO_BATCH_MAX:
+        reply(update, f"Tek mesajda en fazla {KARGO_BATCH_MAX} kargo gönderilebilir.", PRIO_HIGH)
+        return
+
+    title = chat.title or str(chat.id)
+    await cached_group(chat.id, title)
+    # Tekrar kontrolü, hak ayrımı ve outbox kaydı tek transaction'da yapılır; eşzamanlı
+    # komutlar fazla satamaz, aynı update ikinci kez gelirse (update_id) sessizce yok
+    # sayılır. Bu yüzden red kararı cache'ten değil, burada verilir.
+    need = len(valid)
+    status, quota = await run_db(
+        enqueue_kargo, update.update_id, chat.id, title, update.message.message_id, shipments
+    )
+    _set_cached_quota(chat.id, quota)
+    if status == "duplicate":
+        return
+    if status == "disabled":
+        DISABLED_HITS.inc()
+        reply(update, "Bu grupta işlemler kapalıdır. Lütfen @CengizzAtay yazınız.", PRIO_HIGH)
+        return
+    if status == "no_quota":
+        QUOTA_REJECTIONS.inc()
+        if need > 1 and quota > 0:
+            reply(update,
+                f"Hakkınız yetersiz. Bu mesaj için {need} hak gerekiyor, kalan hak: {quota}.",
+                PRIO_HIGH,
+            )
+        else:
+            reply(update, "Hakkınız yoktur. Lütfen @CengizzAtay yaz.", PRIO_HIGH)
+        return
+
+    # Sonuç outbox worker'ından gelir; bu mesaj sonra sonuçla düzenlenir.
+    ack_text = "Kargo kaydı alındı, hazırlanıyor…" if len(shipments) == 1 else \
+        f"{need} kargo kaydı alındı, hazırlanıyor…"
+    outbox_acks[update.update_id] = reply(update, ack_text, PRIO_HIGH)
+    outbox_wakeup.set()
 
 async def kalanhak(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     if chat_kind(chat) == "private":
-        await update.message.reply_text("Bu komut grup içinde kullanılabilir.")
+        reply(update, "Bu komut grup içinde kullanılabilir.", PRIO_HIGH)
         return
-    with db() as con:
-        upsert_group(con, chat.id, chat.title or str(chat.id))
-        g = get_group(con, chat.id)
+    g = await cached_group(chat.id, chat.title or str(chat.id))
     status = "Kapalı" if g["disabled"] else "Açık"
-    await update.message.reply_text(f"Grup: {g['title']}\nDurum: {status}\nKalan Hak: {g['quota']}")
+    reply(update, f"Grup: {g['title']}\nDurum: {status}\nKalan Hak: {g['quota']}")
 
 async def hakver(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -239,88 +1393,495 @@ async def hakver(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     args = (update.message.text or "").strip().split()
     if len(args) != 2 or not args[1].isdigit():
-        await update.message.reply_text("Kullanım: /hakver 5")
+        reply(update, "Kullanım: /hakver 5", PRIO_HIGH)
         return
     quota = int(args[1])
-    with db() as con:
-        set_quota(con, chat.id, chat.title or str(chat.id), quota)
-    await update.message.reply_text(f"Bu gruba {quota} hak verildi.")
+    await update_group(set_quota, chat.id, chat.title or str(chat.id), quota)
+    reply(update, f"Bu gruba {quota} hak verildi.")
 
 async def bitir(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not is_admin(user): return
     chat = update.effective_chat
-    with db() as con:
-        set_disabled(con, chat.id, chat.title or str(chat.id), True)
-    await update.message.reply_text("Bu grup için işlemler kapatıldı.")
+    await update_group(set_disabled, chat.id, chat.title or str(chat.id), True)
+    reply(update, "Bu grup için işlemler kapatıldı.")
 
 async def rapor(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not is_admin(user): return
-    start_iso, end_iso = today_range_iso()
-    with db() as con:
-        rows = con.execute("""
-            SELECT chat_id, chat_title, company, COUNT(*) as cnt
-            FROM logs
-            WHERE created_at >= ? AND created_at < ?
-            GROUP BY chat_id, chat_title, company
-            ORDER BY chat_title COLLATE NOCASE
-        """, (start_iso, end_iso)).fetchall()
-
-        totals = con.execute("""
-            SELECT chat_id, chat_title, COUNT(*) as cnt
-            FROM logs
-            WHERE created_at >= ? AND created_at < ?
-            GROUP BY chat_id, chat_title
-            ORDER BY chat_title COLLATE NOCASE
-        """, (start_iso, end_iso)).fetchall()
+    args = (update.message.text or "").strip().split()[1:]
+    days = [parse_day(a) for a in args[:2]]
+    if len(args) > 2 or None in days:
+        reply(update, "Kullanım: /rapor  veya  /rapor 2025-09-01  veya  /rapor 2025-09-01 2025-09-30", PRIO_HIGH)
+        return
+    start_day = days[0] if days else today_local()
+    end_day = days[1] if len(days) > 1 else start_day
+    if end_day < start_day:
+        start_day, end_day = end_day, start_day
 
+    rows = await run_db(report_rows, start_day.isoformat(), end_day.isoformat())
     if not rows:
-        await update.message.reply_text("Bugün henüz kayıt yok.")
+        if not days:
+            reply(update, "Bugün henüz kayıt yok.", PRIO_LOW)
+        else:
+            reply(update, "Bu tarih aralığında kayıt yok.", PRIO_LOW)
         return
 
+    # Tek geçişte grup toplamları ve firma kırılımı
+    chats = {}
+    for r in rows:
+        c = chats.setdefault(r["chat_id"], {"title": r["chat_title"], "total": 0, "companies": []})
+        c["total"] += r["cnt"]
+        c["companies"].append((r["company"] or "—", r["cnt"]))
+
     parts = []
-    tmap = {r["chat_id"]: r["cnt"] for r in totals}
-    current_chat = None
+    for c in sorted(chats.values(), key=lambda c: (c["title"] or "").lower()):
+        parts.append(f"\n *{md_escape(c['title'])}* — Toplam: *{c['total']}*")
+        for comp, cnt in sorted(c["companies"], key=lambda x: x[0].lower()):
+            parts.append(f"    • {md_escape(comp)}: *{cnt}*")
+
+    if days:
+        span = start_day.isoformat() if start_day == end_day else f"{start_day} / {end_day}"
+        header = f"*Rapor {md_escape(span)}*"
+    else:
+        header = "*Günlük Rapor*"
+    reply(update, header + "\n" + "\n".join(parts), PRIO_LOW, markdown=True)
+
+def export_chunk(con: sqlite3.Connection, writer, start_iso: str, end_iso: str, after: tuple):
+    """(created_at, id) sırasıyla after'dan sonraki en fazla EXPORT_CHUNK satırı CSV'ye yazar."""
+    rows = con.execute("""
+        SELECT id, created_at, chat_id, chat_title, company, item_id FROM logs
+        WHERE created_at >= ? AND created_at < ? AND (created_at, id) > (?, ?)
+        ORDER BY created_at, id LIMIT ?
+    """, (start_iso, end_iso, after[0], after[1], EXPORT_CHUNK)).fetchall()
     for r in rows:
-        if r["chat_id"] != current_chat:
-            current_chat = r["chat_id"]
-            parts.append(f"\n *{r['chat_title']}* — Toplam: *{tmap.get(current_chat,0)}*")
-        comp = r["company"] or "—"
-        parts.append(f"    • {comp}: *{r['cnt']}*")
-
-    await update.message.reply_markdown_v2(
-        "*Günlük Rapor*\n" + "\n".join(parts)
-            .replace("-", "\\-").replace(".", "\\.")
-    )
+        local = dt.datetime.fromisoformat(r["created_at"]).replace(tzinfo=dt.timezone.utc).astimezone(BOT_TZ)
+        writer.writerow([local.strftime("%Y-%m-%d %H:%M:%S"), r["chat_id"], r["chat_title"],
+                         r["company"], r["item_id"]])
+    return len(rows), ((rows[-1]["created_at"], rows[-1]["id"]) if rows else after)
+
+async def disa_aktar(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not is_admin(user): return
+    args = (update.message.text or "").strip().split()[1:]
+    days = [parse_day(a) for a in args[:2]]
+    if len(args) > 2 or None in days:
+        reply(update, "Kullanım: /disa_aktar 2025-09-01 2025-09-30", PRIO_HIGH)
+        return
+    start_day = days[0] if days else today_local()
+    end_day = days[1] if len(days) > 1 else start_day
+    if end_day < start_day:
+        start_day, end_day = end_day, start_day
+    start_iso, end_iso = utc_bounds(start_day, end_day)
+
+    # Tablo belleğe alınmaz: parça parça okunup diskteki geçici dosyaya yazılır
+    f = tempfile.NamedTemporaryFile("w", newline="", encoding="utf-8-sig", suffix=".csv", delete=False)
+    try:
+        with f:
+            writer = csv.writer(f)
+            writer.writerow(["tarih", "chat_id", "grup", "firma", "takip_no"])
+            total, after = 0, ("", 0)
+            while True:
+                n, after = await run_db(export_chunk, writer, start_iso, end_iso, after)
+                total += n
+                if n < EXPORT_CHUNK:
+                    break
+    except Exception:
+        os.unlink(f.name)
+        raise
+    compacted_note = ""
+    if start_day < today_local() - dt.timedelta(days=LOG_RETENTION_DAYS):
+        compacted_note = f"\n{LOG_RETENTION_DAYS} günden eski kayıtların yalnızca özeti (/rapor) tutulur."
+    if not total:
+        os.unlink(f.name)
+        reply(update, "Bu tarih aralığında kayıt yok." + compacted_note, PRIO_LOW)
+        return
+
+    caption = f"{start_day} / {end_day}: {total} kayıt" + compacted_note
+    # Açık dosya yerine yol verilir: _call yeniden denediğinde dosya baştan okunur
+    fut = sender.submit(update.effective_chat.id, [("send_document", {
+        "chat_id": update.effective_chat.id,
+        "document": Path(f.name),
+        "filename": f"kargo_{start_day}_{end_day}.csv",
+        "caption": caption,
+    })], PRIO_LOW)
+    def cleanup(_):
+        os.unlink(f.name)
+    fut.add_done_callback(cleanup)
 
 async def unknown_dm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if chat_kind(update.effective_chat) == "private":
-        await update.message.reply_text("Lütfen @CengizzAtay ile iletişime geçin.")
+        reply(update, "Lütfen @CengizzAtay ile iletişime geçin.", PRIO_HIGH)
 
-# ------------ MAIN ------------
-def main():
-    # 1. ÖNCE Dummy Web Server'ı ayrı bir thread'de başlatıyoruz.
-    # Bu sayede Render, uygulamanın PORT dinlediğini görüp "Live" işaretliyor.
-    t = threading.Thread(target=start_keep_alive, daemon=True)
-    t.start()
+# ------------ WEB SERVER ------------
+# Render Web Service bir port dinlemek zorundadır. Eskiden bunun için ayrı bir
+# thread'de http.server çalışıyordu; artık botun kendi event loop'unda çalışan
+# küçük bir asyncio sunucusu hem health endpoint'ini hem de webhook'u karşılar.
+HTTP_MAX_BODY = 1 << 20
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+                405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+                503: "Service Unavailable"}
+
+# (method, path) -> async fn(headers, body) -> (status, content_type, bytes)
+web_routes: dict = {}
+
+async def health_route(headers: dict, body: bytes):
+    return 200, "text/html", b"Bot calisiyor! (Kargo Bot)"
+
+async def _check_db() -> bool:
+    try:
+        await asyncio.wait_for(run_db(lambda con: con.execute("SELECT 1").fetchone()), timeout=HEALTH_TIMEOUT)
+        return True
+    except Exception as e:
+        log.warning(f"Sağlık kontrolü: DB erişilemiyor: {e!r}")
+        return False
+
+async def _check_backend() -> bool:
+    if http_client is None:
+        return False
+    try:
+        r = await http_client.get("/", timeout=HEALTH_TIMEOUT)
+        return r.status_code < 500
+    except httpx.HTTPError as e:
+        log.warning(f"Sağlık kontrolü: backend erişilemiyor: {e!r}")
+        return False
+
+_health_cache = {"at": 0.0, "status": {}}
+
+async def readiness() -> dict:
+    """DB ve backend durumunu döner; backend'i yormamak için HEALTH_CACHE_SECONDS önbelleklenir."""
+    if time.monotonic() - _health_cache["at"] > HEALTH_CACHE_SECONDS:
+        db_ok, backend_ok = await asyncio.gather(_check_db(), _check_backend())
+        _health_cache["status"] = {"db": db_ok, "backend": backend_ok}
+        if worker_pool is not None:
+            _health_cache["status"]["workers"] = worker_pool.alive()
+        _health_cache["at"] = time.monotonic()
+        for component, ok in _health_cache["status"].items():
+            READY.set(1 if ok else 0, component)
+    return _health_cache["status"]
+
+async def readiness_route(headers: dict, body: bytes):
+    status = await readiness()
+    ok = all(status.values())
+    text = "\n".join(f"{k}: {'ok' if v else 'down'}" for k, v in status.items())
+    return (200 if ok else 503), "text/plain", text.encode()
+
+async def metrics_route(headers: dict, body: bytes):
+    workers = worker_pool.snapshots if worker_pool is not None else None
+    return 200, "text/plain; version=0.0.4", render_metrics(workers).encode()
+
+# "/" Render'ın canlılık kontrolü için sabit kalır; /health gerçek hazır olma durumudur.
+web_routes[("GET", "/")] = health_route
+web_routes[("GET", "/health")] = readiness_route
+web_routes[("GET", "/metrics")] = metrics_route
+
+def webhook_route(app: Application):
+    async def handle(headers: dict, body: bytes):
+        if WEBHOOK_SECRET and headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_SECRET:
+            return 403, "text/plain", b"forbidden"
+        try:
+            data = json.loads(body)
+            # null/dizi gibi gövdeler de geçerli JSON; update her zaman bir nesnedir
+            if not isinstance(data, dict):
+                raise ValueError("update bir JSON nesnesi değil")
+            update = Update.de_json(data, app.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return 400, "text/plain", b"bad update"
+        # Update işlenmeden 200 dönülür; Telegram beklemeden sıradakini gönderebilir.
+        await app.update_queue.put(update)
+        return 200, "text/plain", b"ok"
+    return handle
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    status, ctype, payload = 500, "text/plain", b"error"
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > HTTP_MAX_BODY:
+            status, payload = 413, b"too large"
+        else:
+            body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+            path = target.split("?", 1)[0]
+            route = web_routes.get((method, path))
+            if route is None:
+                known = any(p == path for _, p in web_routes)
+                status, payload = (405, b"method not allowed") if known else (404, b"not found")
+            else:
+                status, ctype, payload = await route(headers, body)
+    except (ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        status, payload = 400, b"bad request"
+    except Exception as e:
+        log.error(f"HTTP handler hatası: {e!r}")
+    try:
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_web_server(port: int = PORT, host: str = "0.0.0.0") -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_handle_http, host, port)
+    log.info(f"Web server {port} portunda baslatildi.")
+    return server
+
+# ------------ WORKERS ------------
+# BOT_WORKERS > 1 iken ana süreç (supervisor) update'leri Telegram'dan alır ve
+# chat_id'ye göre işçi süreçlere dağıtır; bir grubun bütün update'leri hep aynı
+# işçiye gider ve orada geliş sırasıyla işlenir. Grup cache'i, outbox ve gönderim
+# kuyruğu işçi başına shard'lanır; hak rezervasyonu ise ortak SQLite dosyasında
+# UPDATE ... RETURNING ile transaction içinde yapılır.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Farklı sohbetlerin update'leri paralel, aynı sohbetinkiler sırayla işlenir.
+
+    PTB kendi semaforunu do_process_update'ten önce alır; o sınır kullanılsaydı tek
+    bir kalabalık grubun kilit bekleyen update'leri bütün slotları tutup diğer
+    grupları durdururdu. Bu yüzden PTB semaforu fiilen sınırsız bırakılır ve
+    asıl sınır (limit) sohbet kilidi alındıktan sonra uygulanır."""
+
+    _UNBOUNDED = 1 << 30
 
-    # 2. Sonra Bot'u başlatıyoruz.
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates pozitif olmalı")
+        super().__init__(self._UNBOUNDED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks: dict = {}   # chat_id -> [Lock, bekleyen sayısı]
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self._slots:
+                await coroutine
+            return
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:   # asyncio.Lock FIFO: geliş sırası korunur
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._chat_locks.pop(chat.id, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+class WorkerPool:
+    """Supervisor tarafı: işçi süreçleri başlatır, ölenleri yeniden başlatır,
+    update'leri shard'larına yollar ve işçilerin metriklerini toplar."""
+
+    def __init__(self, count: int):
+        self.ctx = mp.get_context("spawn")
+        self.count = count
+        self.inboxes = [self.ctx.Queue() for _ in range(count)]
+        self.metrics_in = self.ctx.Queue()
+        self.procs: list = [None] * count
+        self.snapshots: dict = {}   # "işçi no" -> metrics_snapshot()
+        self._stopping = False
+        self._monitor: Optional[asyncio.Task] = None
+        self._collector: Optional[threading.Thread] = None
+
+    def _spawn(self, i: int):
+        p = self.ctx.Process(target=worker_main, args=(i, self.count, self.inboxes[i], self.metrics_in),
+                             name=f"kargo-worker-{i}", daemon=True)
+        p.start()
+        self.procs[i] = p
+
+    def start(self):
+        for i in range(self.count):
+            self._spawn(i)
+        self._collector = threading.Thread(target=self._collect, name="kargo-metrics", daemon=True)
+        self._collector.start()
+        self._monitor = asyncio.create_task(self._watch())
+        log.info(f"{self.count} işçi süreç başlatıldı.")
+
+    def _collect(self):
+        while True:
+            item = self.metrics_in.get()
+            if item is None:
+                return
+            index, snap = item
+            self.snapshots[str(index)] = snap
+
+    async def _watch(self):
+        while not self._stopping:
+            await asyncio.sleep(5)
+            for i, p in enumerate(self.procs):
+                if not self._stopping and not p.is_alive():
+                    log.error(f"İşçi {i} durdu (exit {p.exitcode}), yeniden başlatılıyor.")
+                    self._spawn(i)
+
+    def alive(self) -> bool:
+        return all(p is not None and p.is_alive() for p in self.procs)
+
+    def route(self, update: Update):
+        chat = update.effective_chat
+        self.inboxes[shard_of(chat.id if chat else 0, self.count)].put(update.to_dict())
+
+    async def stop(self, timeout: float = 30):
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for q in self.inboxes:
+            q.put(None)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for i, p in enumerate(self.procs):
+            await loop.run_in_executor(None, p.join, max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                log.warning(f"İşçi {i} zamanında kapanmadı, sonlandırılıyor.")
+                p.kill()
+        self.metrics_in.put(None)
+
+worker_pool: Optional[WorkerPool] = None
+
+async def serve_worker(app: Application, inbox, metrics_out):
+    """İşçi süreç: supervisor'dan gelen update'leri kendi Application'ına verir."""
+    loop = asyncio.get_running_loop()
+    await app.initialize()
+    await on_startup(app)
+    await app.start()
+
+    async def push_metrics():
+        while True:
+            await asyncio.sleep(WORKER_METRICS_INTERVAL)
+            metrics_out.put((WORKER_INDEX, metrics_snapshot()))
+
+    pusher = asyncio.create_task(push_metrics())
+    try:
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:   # supervisor kapanıyor
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        pusher.cancel()
+        if app.running:
+            await app.stop()
+        await on_shutdown(app)
+        metrics_out.put((WORKER_INDEX, metrics_snapshot()))
+        await app.shutdown()
+
+def worker_main(index: int, count: int, inbox, metrics_out):
+    global WORKER_INDEX, WORKER_COUNT, TG_GLOBAL_RATE
+    # Kapanışı supervisor yönetir (kuyruğa None); sinyallerle yarıda kesilmeyelim
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    WORKER_INDEX, WORKER_COUNT = index, count
+    TG_GLOBAL_RATE = TG_GLOBAL_RATE / count   # global Telegram limiti işçiler arasında paylaşılır
+    asyncio.run(serve_worker(build_application(updater=False), inbox, metrics_out))
+
+def build_router(pool: WorkerPool) -> Application:
+    """Supervisor'ın Application'ı: komut işlemez, her update'i shard'ına yollar."""
     app = Application.builder().token(BOT_TOKEN).build()
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("kargo", kargo))
-    app.add_handler(CommandHandler("kalanhak", kalanhak))
-    app.add_handler(CommandHandler("hakver", hakver))
-    app.add_handler(CommandHandler("bitir", bitir))
-    app.add_handler(CommandHandler("rapor", rapor))
+    async def route(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        pool.route(update)
+
+    app.add_handler(TypeHandler(Update, route))
+    app.bot_data["pool"] = pool
+    return app
+
+async def supervisor_startup(app: Application):
+    global http_client, worker_pool
+    http_client = build_http_client()   # yalnızca /health backend kontrolü için
+    worker_pool = pool = app.bot_data["pool"]
+    pool.start()
+
+async def supervisor_shutdown(app: Application):
+    global http_client
+    await app.bot_data["pool"].stop()
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    close_db()
 
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & ~filters.COMMAND, dm_guard))
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.COMMAND, dm_guard))
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE, unknown_dm))
+# ------------ MAIN ------------
+def build_application(updater: bool = True) -> Application:
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(BOT_CONCURRENCY))
+    )
+    if not updater:   # işçi süreçler update'leri supervisor'dan alır
+        builder = builder.updater(None)
+    app = builder.build()
+
+    app.add_handler(CommandHandler("start", instrument("start", start)))
+    app.add_handler(CommandHandler("kargo", instrument("kargo", kargo)))
+    app.add_handler(CommandHandler("kalanhak", instrument("kalanhak", kalanhak)))
+    app.add_handler(CommandHandler("hakver", instrument("hakver", hakver)))
+    app.add_handler(CommandHandler("bitir", instrument("bitir", bitir)))
+    app.add_handler(CommandHandler("rapor", instrument("rapor", rapor)))
+    app.add_handler(CommandHandler("disa_aktar", instrument("disa_aktar", disa_aktar)))
+
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & ~filters.COMMAND, instrument("dm_guard", dm_guard)))
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.COMMAND, instrument("dm_guard", dm_guard)))
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE, instrument("unknown_dm", unknown_dm)))
+    return app
 
-    log.info("Bot starting…")
-    app.run_polling()
+async def serve(app: Application, startup=on_startup, shutdown=on_shutdown):
+    """Web server + bot aynı event loop'ta. WEBHOOK_URL varsa webhook, yoksa polling."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await app.initialize()
+    await startup(app)
+    server = await start_web_server()
+    try:
+        if WEBHOOK_URL:
+            web_routes[("POST", WEBHOOK_PATH)] = webhook_route(app)
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            log.info(f"Bot starting (webhook: {WEBHOOK_URL}{WEBHOOK_PATH})…")
+        else:
+            # start_polling kayıtlı bir webhook varsa önce onu siler
+            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            log.info("Bot starting (polling)…")
+        await app.start()
+        await stop.wait()
+    finally:
+        if app.updater.running:
+            await app.updater.stop()
+        if app.running:
+            await app.stop()
+        server.close()
+        await server.wait_closed()
+        await shutdown(app)
+        await app.shutdown()
+
+def main():
+    if BOT_WORKERS > 1:
+        asyncio.run(serve(build_router(WorkerPool(BOT_WORKERS)), supervisor_startup, supervisor_shutdown))
+    else:
+        asyncio.run(serve(build_application()))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,6 @@
+"""bot.py'yi ağa çıkmadan, geçici bir DB ile import eder (bot_state.sqlite'a dokunulmaz)."""
+import os, sys, tempfile
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ["BOT_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="kargo-test-"), "test.sqlite")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+"""Testlerde ortak sahte nesneler."""
+import asyncio
+
+from telegram import Update
+
+import bot
+
+
+class RecordingSender:
+    """ReplyScheduler yerine: gönderilecek metinleri kaydeder."""
+
+    def __init__(self):
+        self.texts = []
+
+    def submit(self, chat_id, calls, priority=bot.PRIO_NORMAL):
+        self.texts.extend(kw.get("text") for _, kw in calls)
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(None)
+        return fut
+
+
+def kargo_update(update_id: int, chat_id: int, blocks: int, name: str = "Müşteri") -> Update:
+    text = "/kargo\n" + "\n\n".join(
+        f"{name} {i}\nAdres {i}\n01.10.2026\nFirma" for i in range(blocks))
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "group", "title": "Test"},
+            "from": {"id": 1, "is_bot": False, "first_name": "t"},
+            "text": text,
+        },
+    }, None)
+
+
+def admin_update(update_id: int, chat_id: int, text: str, chat_type: str = "private") -> Update:
+    """ADMIN_USERNAME'den gelen bir komut mesajı."""
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": {"id": 1, "is_bot": False, "first_name": "a", "username": bot.ADMIN_USERNAME},
+            "text": text,
+        },
+    }, None)
@@ -0,0 +1,54 @@
+"""/disa_aktar: CSV gönderimi yeniden denendiğinde dosya baştan okunur."""
+import asyncio
+import unittest
+from pathlib import Path
+
+from telegram.error import TimedOut
+
+import bot
+from helpers import admin_update
+
+
+class FlakyBot:
+    """İlk send_document çağrısında dosyayı okuyup zaman aşımı verir."""
+
+    def __init__(self):
+        self.uploads = []
+        self.paths = []
+
+    async def send_document(self, chat_id, document, filename=None, caption=None):
+        # python-telegram-bot gibi: yol her çağrıda yeniden açılır, dosya nesnesi olduğu gibi okunur
+        if isinstance(document, Path):
+            path, data = document, document.read_bytes()
+        else:
+            path, data = Path(document.name), document.read()
+        self.uploads.append(data)
+        self.paths.append(path)
+        if len(self.uploads) == 1:
+            raise TimedOut()
+        return "ok"
+
+
+class ExportRetryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fake = FlakyBot()
+        self.sender, bot.sender = bot.sender, bot.ReplyScheduler(self.fake, senders=1)
+        bot.sender.start()
+        await bot.run_db(bot.log_create, -4001, "Test", "TRK1", "Firma")
+
+    async def asyncTearDown(self):
+        await bot.sender.stop()
+        bot.sender = self.sender
+
+    async def test_retried_upload_sends_whole_file(self):
+        await bot.disa_aktar(admin_update(7001, 1, "/disa_aktar"), None)
+        for _ in range(100):   # ilk denemeden sonra 1 sn beklenir
+            if self.fake.paths and not self.fake.paths[0].exists():
+                break
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(len(self.fake.uploads), 2)
+        self.assertTrue(self.fake.uploads[0])
+        self.assertEqual(self.fake.uploads[1], self.fake.uploads[0])
+        self.assertIn(b"TRK1", self.fake.uploads[1])
+        self.assertFalse(self.fake.paths[0].exists())   # geçici dosya silindi
@@ -0,0 +1,45 @@
+"""/kargo: hak ayrımı ve tekrar gelen update'ler (outbox worker'ı çalıştırılmaz)."""
+import unittest
+
+import bot
+from helpers import RecordingSender, kargo_update
+
+
+class KargoQuotaTest(unittest.IsolatedAsyncioTestCase):
+    chat_id = -2001
+
+    async def asyncSetUp(self):
+        self.sender, bot.sender = bot.sender, RecordingSender()
+        bot.outbox_acks.clear()
+        await bot.update_group(bot.set_quota, self.chat_id, "Test", 3)
+
+    async def asyncTearDown(self):
+        bot.sender = self.sender
+        bot.outbox_acks.clear()
+
+    async def test_redelivered_update_is_ignored_before_quota_check(self):
+        update = kargo_update(5001, self.chat_id, 2)
+        rejections = bot.QUOTA_REJECTIONS.values[()]
+        await bot.kargo(update, None)
+        self.assertEqual(await bot.current_quota(self.chat_id), 1)
+        self.assertEqual(len(bot.sender.texts), 1)          # yalnızca "hazırlanıyor"
+
+        await bot.kargo(kargo_update(5001, self.chat_id, 2), None)
+        self.assertEqual(len(bot.sender.texts), 1)          # "Hakkınız yetersiz" yok
+        self.assertEqual(bot.QUOTA_REJECTIONS.values[()], rejections)
+        self.assertEqual(await bot.current_quota(self.chat_id), 1)
+
+    async def test_new_update_without_quota_is_rejected(self):
+        await bot.kargo(kargo_update(5101, self.chat_id, 2), None)
+        await bot.kargo(kargo_update(5102, self.chat_id, 2), None)
+        self.assertIn("Hakkınız yetersiz", bot.sender.texts[-1])
+        self.assertEqual(await bot.current_quota(self.chat_id), 1)
+
+    async def test_disabled_group_is_rejected(self):
+        await bot.update_group(bot.set_disabled, self.chat_id, "Test", True)
+        try:
+            await bot.kargo(kargo_update(5201, self.chat_id, 1), None)
+            self.assertIn("kapalıdır", bot.sender.texts[-1])
+            self.assertEqual(await bot.current_quota(self.chat_id), 3)
+        finally:
+            await bot.update_group(bot.set_disabled, self.chat_id, "Test", False)
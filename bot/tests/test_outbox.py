@@ -0,0 +1,73 @@
+"""Outbox worker'ı: yerel sahte /api/tracking ile uçtan uca."""
+import asyncio, json, time, unittest
+
+import bot
+from helpers import RecordingSender, kargo_update
+
+
+class FakeTracking:
+    """Adı "Yavaş" ile başlayan gönderiler geç, "Red" ile başlayanlar 400 döner."""
+
+    def __init__(self, slow: float):
+        self.slow = slow
+        self.calls = []
+
+    async def __call__(self, headers: dict, body: bytes):
+        name = json.loads(body)["full_name"]
+        self.calls.append(name)
+        if name.startswith("Yavaş"):
+            await asyncio.sleep(self.slow)
+        if name.startswith("Red"):
+            return 400, "application/json", b'{"error":"bad request"}'
+        return 200, "application/json", json.dumps({"id": name, "url": "http://fake/t/1"}).encode()
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    chat_id = -3001
+
+    async def asyncSetUp(self):
+        asyncio.get_running_loop().set_debug(False)   # süre ölçülüyor
+        self.saved = bot.sender, bot.http_client, bot.API_BASE, bot.SHORTENER_ORDER
+        self.tracking = FakeTracking(slow=3)
+        bot.web_routes[("POST", "/api/tracking")] = self.tracking
+        self.server = await bot.start_web_server(0, "127.0.0.1")
+        bot.API_BASE = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        bot.http_client = bot.build_http_client()
+        bot.SHORTENER_ORDER = []
+        bot.sender = RecordingSender()
+        bot.outbox_wakeup = asyncio.Event()   # her test kendi event loop'unda
+        await bot.update_group(bot.set_quota, self.chat_id, "Test", 10)
+        self.loop_task = asyncio.create_task(bot.outbox_loop())
+
+    async def asyncTearDown(self):
+        self.loop_task.cancel()
+        await asyncio.gather(self.loop_task, return_exceptions=True)
+        if bot._final_tasks:
+            await asyncio.wait(bot._final_tasks, timeout=5)
+        await bot.http_client.aclose()
+        self.server.close()
+        await self.server.wait_closed()
+        bot.web_routes.pop(("POST", "/api/tracking"), None)
+        bot.sender, bot.http_client, bot.API_BASE, bot.SHORTENER_ORDER = self.saved
+
+    async def wait_for_text(self, needle: str, timeout: float) -> float:
+        t0 = time.monotonic()
+        while not any(needle in t for t in bot.sender.texts):
+            if time.monotonic() - t0 > timeout:
+                self.fail(f"{needle!r} içeren cevap {timeout}s içinde gelmedi: {bot.sender.texts}")
+            await asyncio.sleep(0.02)
+        return time.monotonic() - t0
+
+    async def test_slow_row_does_not_hold_back_new_rows(self):
+        await bot.kargo(kargo_update(6001, self.chat_id, 1, "Yavaş"), None)
+        await asyncio.sleep(0.2)   # yavaş satır işlemde
+        await bot.kargo(kargo_update(6002, self.chat_id, 1, "Hızlı"), None)
+        self.assertLess(await self.wait_for_text("Hızlı 0", timeout=1.5), 1.5)
+        self.assertFalse(any("Yavaş 0" in t for t in bot.sender.texts if "hazırlanıyor" not in t))
+        await self.wait_for_text("Yavaş 0", timeout=5)
+
+    async def test_client_error_fails_without_retry(self):
+        await bot.kargo(kargo_update(6101, self.chat_id, 1, "Red"), None)
+        await self.wait_for_text("Sunucuya ulaşılamadı", timeout=2)
+        self.assertEqual([c for c in self.tracking.calls if c.startswith("Red")], ["Red 0"])
+        self.assertEqual(await bot.current_quota(self.chat_id), 10)   # hak iade edildi
@@ -0,0 +1,51 @@
+"""parse_kargo_text: blok ayırma ve tek gönderilik eski davranış."""
+import unittest
+
+import bot
+
+
+def block(i: int) -> str:
+    return f"Müşteri {i}\nAdres {i}\n0{i}.10.2026\nFirma {i}"
+
+
+def names(shipments):
+    return [s and s["full_name"] for s in shipments]
+
+
+class ParseKargoTextTest(unittest.TestCase):
+    def test_single_block(self):
+        [s] = bot.parse_kargo_text("/kargo\n" + block(1))
+        self.assertEqual(s, {"full_name": "Müşteri 1", "address": "Adres 1", "eta_str": "01.10.2026",
+                             "api_eta": "2026-10-01", "company": "Firma 1"})
+
+    def test_single_block_with_extra_lines_keeps_first_four(self):
+        [s] = bot.parse_kargo_text("/kargo\n" + block(1) + "\nNot: kapıya bırakın\nTeşekkürler")
+        self.assertEqual(s["company"], "Firma 1")
+
+    def test_four_lines_split_by_blank_line_is_one_shipment(self):
+        [s] = bot.parse_kargo_text("/kargo\nMüşteri 1\nAdres 1\n\n01/10/2026\nFirma 1")
+        self.assertEqual((s["full_name"], s["company"], s["api_eta"]), ("Müşteri 1", "Firma 1", "2026-10-01"))
+
+    def test_trailing_extra_block_is_invalid(self):
+        shipments = bot.parse_kargo_text("/kargo\n" + block(1) + "\n\nTeşekkürler")
+        self.assertEqual(names(shipments), ["Müşteri 1", None])
+
+    def test_mixed_batch(self):
+        text = "\n\n".join(["/kargo\n" + block(1),
+                            "Müşteri 2\nAdres 2\n02.10.2026",            # 3 satır
+                            block(3),
+                            block(4) + "\nFazla satır",                  # 5 satır
+                            block(5)])
+        self.assertEqual(names(bot.parse_kargo_text(text)), ["Müşteri 1", None, "Müşteri 3", None, "Müşteri 5"])
+
+    def test_blank_lines_and_spaces_are_ignored(self):
+        shipments = bot.parse_kargo_text("/kargo\n\n\n  " + block(1) + "  \n \n\n" + block(2) + "\n\n")
+        self.assertEqual(names(shipments), ["Müşteri 1", "Müşteri 2"])
+
+    def test_too_few_lines(self):
+        self.assertEqual(bot.parse_kargo_text("/kargo"), [])
+        self.assertEqual(bot.parse_kargo_text("/kargo\nMüşteri\nAdres\n01.10.2026"), [])
+
+    def test_unparsable_date_is_sent_as_written(self):
+        [s] = bot.parse_kargo_text("/kargo\nMüşteri\nAdres\nyarın\nFirma")
+        self.assertEqual(s["api_eta"], "yarın")
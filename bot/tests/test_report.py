@@ -0,0 +1,121 @@
+"""daily_counts özeti: BOT_TZ gün sınırları, /rapor aralıkları ve logs'tan geri doldurma."""
+import datetime as dt
+import os
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import bot
+from helpers import RecordingSender, admin_update
+
+
+def frozen_dt(now: dt.datetime):
+    """bot.dt yerine: datetime.utcnow() hep `now` döner."""
+    class Frozen(dt.datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+    return SimpleNamespace(**{**vars(dt), "datetime": Frozen})
+
+
+def scratch_db() -> sqlite3.Connection:
+    """Botun logs/daily_counts şemasıyla boş, ayrı bir veritabanı."""
+    src = sqlite3.connect(bot.DB_PATH)
+    try:
+        schema = [r[0] for r in src.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name IN ('logs', 'daily_counts') AND sql IS NOT NULL")]
+    finally:
+        src.close()
+    con = sqlite3.connect(os.path.join(tempfile.mkdtemp(prefix="kargo-report-"), "r.sqlite"))
+    con.row_factory = sqlite3.Row
+    for sql in schema:
+        con.execute(sql)
+    return con
+
+
+def counts(con):
+    return {(r["day"], r["company"]): r["cnt"] for r in con.execute("SELECT * FROM daily_counts")}
+
+
+class DayBucketTest(unittest.TestCase):
+    """Europe/Istanbul UTC+3: 20:59 UTC aynı gün, 21:00 UTC ertesi gün."""
+
+    def setUp(self):
+        self.con = scratch_db()
+        self.addCleanup(self.con.close)
+
+    def log_at(self, when: dt.datetime, company="Firma", title="Grup"):
+        with mock.patch.object(bot, "dt", frozen_dt(when)):
+            bot.log_create(self.con, -6001, title, "TRK", company)
+
+    def test_local_day_near_midnight(self):
+        self.assertEqual(bot.local_day(dt.datetime(2024, 3, 1, 20, 59, 59)), "2024-03-01")
+        self.assertEqual(bot.local_day(dt.datetime(2024, 3, 1, 21, 0, 0)), "2024-03-02")
+
+    def test_log_create_buckets_by_local_day(self):
+        self.log_at(dt.datetime(2024, 3, 1, 20, 59, 59))
+        self.log_at(dt.datetime(2024, 3, 1, 21, 0, 0))
+        self.log_at(dt.datetime(2024, 3, 2, 5, 0, 0))
+        self.assertEqual(counts(self.con), {("2024-03-01", "Firma"): 1, ("2024-03-02", "Firma"): 2})
+
+    def test_backfill_matches_log_create(self):
+        times = [dt.datetime(2024, 3, 1, 20, 59, 59), dt.datetime(2024, 3, 1, 21, 0, 0),
+                 dt.datetime(2024, 3, 2, 5, 0, 0)]
+        for t in times:
+            self.log_at(t)
+        self.log_at(dt.datetime(2024, 3, 2, 6, 0, 0), company=None)
+        expected = counts(self.con)
+
+        self.con.execute("DELETE FROM daily_counts")
+        self.con.execute("INSERT INTO logs(chat_id, chat_title, item_id, company, created_at) "
+                         "VALUES (-6001, 'Grup', 'TRK', 'Firma', 'bozuk')")   # atlanır
+        bot.backfill_daily_counts(self.con)
+        self.assertEqual(counts(self.con), expected)
+        self.assertEqual(expected[("2024-03-02", "")], 1)
+
+        bot.backfill_daily_counts(self.con)   # doluysa dokunmaz
+        self.assertEqual(counts(self.con), expected)
+
+
+class RaporTest(unittest.IsolatedAsyncioTestCase):
+    chat_id = -6101
+
+    async def asyncSetUp(self):
+        self.sender, bot.sender = bot.sender, RecordingSender()
+        await bot.run_db(self.seed)
+
+    async def asyncTearDown(self):
+        bot.sender = self.sender
+        await bot.run_db(lambda con: con.execute(
+            "DELETE FROM daily_counts WHERE chat_id = ?", (self.chat_id,)))
+
+    def seed(self, con):
+        bot.bump_daily_count(con, "2023-05-01", self.chat_id, "Eski Ad", "Aras", 2)
+        bot.bump_daily_count(con, "2023-05-01", self.chat_id, "Eski Ad", "Yurtiçi", 1)
+        bot.bump_daily_count(con, "2023-05-02", self.chat_id, "Yeni Ad", "Aras", 4)
+
+    async def rapor(self, text):
+        await bot.rapor(admin_update(6100, 1, text), None)
+        return bot.sender.texts[-1]
+
+    async def test_single_day(self):
+        text = await self.rapor("/rapor 2023-05-01")
+        self.assertIn("Rapor 2023\\-05\\-01", text)
+        self.assertIn("*Eski Ad* — Toplam: *3*", text)
+        self.assertIn("Aras: *2*", text)
+        self.assertIn("Yurtiçi: *1*", text)
+
+    async def test_range_uses_latest_title(self):
+        text = await self.rapor("/rapor 2023-05-01 2023-05-02")
+        self.assertIn("*Yeni Ad* — Toplam: *7*", text)
+        self.assertNotIn("Eski Ad", text)
+        self.assertIn("Aras: *6*", text)
+
+    async def test_reversed_range(self):
+        self.assertEqual(await self.rapor("/rapor 02.05.2023 01.05.2023"),
+                         await self.rapor("/rapor 2023-05-01 2023-05-02"))
+
+    async def test_empty_range(self):
+        self.assertEqual(await self.rapor("/rapor 2023-06-01"), "Bu tarih aralığında kayıt yok.")
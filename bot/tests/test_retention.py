@@ -0,0 +1,77 @@
+"""run_retention: eski logs satırları parça parça silinir, özetler ve bekleyen outbox kalır."""
+import datetime as dt
+import unittest
+from unittest import mock
+
+import bot
+from helpers import RecordingSender, admin_update
+
+
+class RetentionTest(unittest.IsolatedAsyncioTestCase):
+    chat_id = -7001
+
+    async def asyncSetUp(self):
+        self.sender, bot.sender = bot.sender, RecordingSender()
+        now = dt.datetime.utcnow()
+        self.old = now - dt.timedelta(days=bot.LOG_RETENTION_DAYS + 2)
+        self.old_outbox = now - dt.timedelta(days=bot.OUTBOX_RETENTION_DAYS + 1)
+        await bot.run_db(self.seed, now)
+
+    async def asyncTearDown(self):
+        bot.sender = self.sender
+        await bot.run_db(self.cleanup)
+
+    def seed(self, con, now):
+        for i in range(7):
+            t = (self.old + dt.timedelta(minutes=i)).isoformat()
+            con.execute("INSERT INTO logs(chat_id, chat_title, item_id, company, created_at) "
+                        "VALUES (?, 'Arşiv', ?, 'Aras', ?)", (self.chat_id, f"OLD{i}", t))
+        bot.bump_daily_count(con, bot.local_day(self.old), self.chat_id, "Arşiv", "Aras", 7)
+        bot.log_create(con, self.chat_id, "Arşiv", "NEW", "Aras")
+        for update_id, status, replied, created in [
+                (7001, "done", 1, self.old_outbox),   # silinir
+                (7002, "pending", 0, self.old_outbox),
+                (7003, "done", 1, now)]:
+            con.execute("INSERT INTO outbox(update_id, seq, chat_id, total, status, replied, created_at) "
+                        "VALUES (?, 0, ?, 1, ?, ?, ?)", (update_id, self.chat_id, status, replied, created.isoformat()))
+
+    def cleanup(self, con):
+        for table in ("logs", "daily_counts", "outbox"):
+            con.execute(f"DELETE FROM {table} WHERE chat_id = ?", (self.chat_id,))
+
+    def remaining(self, con):
+        logs = [r[0] for r in con.execute("SELECT item_id FROM logs WHERE chat_id = ?", (self.chat_id,))]
+        outbox = [r[0] for r in con.execute(
+            "SELECT update_id FROM outbox WHERE chat_id = ? ORDER BY update_id", (self.chat_id,))]
+        return logs, outbox
+
+    async def test_old_rows_are_deleted_in_batches(self):
+        batches = []
+
+        def recording_delete(con, cutoff_iso, limit):
+            n = real_delete(con, cutoff_iso, limit)
+            batches.append((limit, n))
+            return n
+
+        real_delete = bot.delete_old_logs
+        with mock.patch.object(bot, "RETENTION_BATCH", 3), \
+             mock.patch.object(bot, "delete_old_logs", recording_delete):
+            removed = await bot.run_retention()
+
+        self.assertEqual(removed, 7)
+        self.assertEqual(batches, [(3, 3), (3, 3), (3, 1)])
+        logs, outbox = await bot.run_db(self.remaining)
+        self.assertEqual(logs, ["NEW"])
+        self.assertEqual(outbox, [7002, 7003])
+
+        # Silinen günler /rapor'da daily_counts'tan gelmeye devam eder
+        day = bot.local_day(self.old)
+        await bot.rapor(admin_update(7100, 1, f"/rapor {day}"), None)
+        self.assertIn("*Arşiv* — Toplam: *7*", bot.sender.texts[-1])
+
+    async def test_nothing_to_delete(self):
+        await bot.run_db(lambda con: con.execute(
+            "DELETE FROM logs WHERE chat_id = ? AND item_id LIKE 'OLD%'", (self.chat_id,)))
+        self.assertEqual(await bot.run_retention(), 0)
+        logs, _ = await bot.run_db(self.remaining)
+        self.assertEqual(logs, ["NEW"])
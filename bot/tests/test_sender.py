@@ -0,0 +1,46 @@
+"""ReplyScheduler: hangi Telegram hataları yeniden denenir."""
+import asyncio
+import unittest
+
+from telegram.error import BadRequest, NetworkError
+
+import bot
+
+
+class FailingBot:
+    """edit_message_text sırayla verilen hataları fırlatır, sonra başarılı olur."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def edit_message_text(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "edited"
+
+
+class ReplySchedulerRetryTest(unittest.IsolatedAsyncioTestCase):
+    async def send(self, fake):
+        sender = bot.ReplyScheduler(fake, senders=1)
+        sender.start()
+        try:
+            fut = sender.submit(-5001, [("edit_message_text", {
+                "chat_id": -5001, "message_id": 1, "text": "x"})])
+            return await asyncio.wait_for(fut, timeout=5)
+        finally:
+            await sender.stop()
+
+    async def test_bad_request_is_attempted_once(self):
+        fake = FailingBot(*[BadRequest("Message to edit not found")] * 5)
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        self.assertIsNone(await self.send(fake))
+        self.assertEqual(fake.calls, 1)
+        self.assertLess(loop.time() - t0, 0.5)
+
+    async def test_network_error_is_retried(self):
+        fake = FailingBot(NetworkError("bağlantı koptu"))
+        self.assertEqual(await self.send(fake), "edited")
+        self.assertEqual(fake.calls, 2)
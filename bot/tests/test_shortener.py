@@ -0,0 +1,140 @@
+"""Link kısaltma: yerel sahte sağlayıcılarla hedge, devre kesici, önbellek ve bütçe."""
+import asyncio, itertools, time, unittest
+
+import bot
+
+_urls = itertools.count()
+
+
+def long_url() -> str:
+    return f"http://backend.test/t/{next(_urls)}-{time.time_ns()}"
+
+
+class FakeProvider:
+    def __init__(self, name: str, latency: float = 0.0, status: int = 200):
+        self.name, self.latency, self.status = name, latency, status
+        self.calls = 0
+
+    async def __call__(self, headers: dict, body: bytes):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.status != 200:
+            return self.status, "text/plain", b"unavailable"
+        return 200, "text/plain", f"http://s.test/{self.name}/{self.calls}".encode()
+
+
+class ShortenerTest(unittest.IsolatedAsyncioTestCase):
+    settings = {
+        "SHORTENER_HEDGE_DELAY": 0.1,
+        "SHORTENER_TIMEOUT": 3,
+        "SHORTENER_BUDGET": 1.0,
+        "SHORTENER_BREAKER_FAILURES": 2,
+        "SHORTENER_BREAKER_COOLDOWN": 0.3,
+        "SHORTENER_MAX_CONNECTIONS": 20,
+    }
+
+    async def asyncSetUp(self):
+        # IsolatedAsyncioTestCase debug modunda çalışır; süre ölçen testleri yavaşlatmasın
+        asyncio.get_running_loop().set_debug(False)
+        names = list(self.settings) + ["SHORTENERS", "SHORTENER_ORDER", "shortener_clients"]
+        self.saved = {n: getattr(bot, n) for n in names}
+        for n, v in self.settings.items():
+            setattr(bot, n, v)
+        self.providers = {n: FakeProvider(n) for n in ("a", "b", "c")}
+        for n, p in self.providers.items():
+            bot.web_routes[("GET", f"/short/{n}")] = p
+        self.server = await bot.start_web_server(0, "127.0.0.1")
+        base = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        bot.SHORTENERS = {n: ("GET", f"{base}/short/{n}", "params", bot._parse_text) for n in self.providers}
+        bot.SHORTENER_ORDER = list(self.providers)
+        bot._breakers.clear()
+
+    async def start_clients(self):
+        bot.shortener_clients = bot.build_shortener_clients()
+
+    async def asyncTearDown(self):
+        for t in list(bot._shorten_inflight.values()):
+            t.cancel()
+        await asyncio.gather(*bot._shorten_inflight.values(), return_exceptions=True)
+        await asyncio.gather(*(c.aclose() for c in bot.shortener_clients.values()))
+        self.server.close()
+        await self.server.wait_closed()
+        for n in self.providers:
+            bot.web_routes.pop(("GET", f"/short/{n}"), None)
+        for n, v in self.saved.items():
+            setattr(bot, n, v)
+        bot._breakers.clear()
+
+    def calls(self) -> dict:
+        return {n: p.calls for n, p in self.providers.items()}
+
+    async def test_first_provider_answers_alone(self):
+        await self.start_clients()
+        short = await bot.shorten_url(long_url())
+        self.assertTrue(short.startswith("http://s.test/a/"))
+        self.assertEqual(self.calls(), {"a": 1, "b": 0, "c": 0})
+
+    async def test_slow_provider_is_hedged_in_order(self):
+        self.providers["a"].latency = 0.5
+        await self.start_clients()
+        t0 = time.monotonic()
+        short = await bot.shorten_url(long_url())
+        self.assertTrue(short.startswith("http://s.test/b/"))
+        self.assertLess(time.monotonic() - t0, 0.4)
+        self.assertEqual(self.calls(), {"a": 1, "b": 1, "c": 0})
+
+    async def test_failed_provider_falls_through_without_waiting(self):
+        self.providers["a"].status = 503
+        await self.start_clients()
+        short = await bot.shorten_url(long_url())
+        self.assertTrue(short.startswith("http://s.test/b/"))
+
+    async def test_cache_hit_skips_providers(self):
+        await self.start_clients()
+        url = long_url()
+        first = await bot.shorten_url(url)
+        self.assertEqual(await bot.shorten_url(url), first)
+        self.assertEqual(self.calls(), {"a": 1, "b": 0, "c": 0})
+
+    async def test_budget_falls_back_to_long_url_and_keeps_result(self):
+        for p in self.providers.values():
+            p.latency = 1.5
+        await self.start_clients()
+        url = long_url()
+        t0 = time.monotonic()
+        self.assertEqual(await bot.shorten_url(url), url)
+        self.assertLess(time.monotonic() - t0, bot.SHORTENER_BUDGET + 0.3)
+        # kısaltma arka planda sürer ve saklanır
+        await asyncio.wait_for(asyncio.shield(bot._shorten_inflight[url]), timeout=3)
+        self.assertTrue((await bot.shorten_url(url)).startswith("http://s.test/"))
+
+    async def test_breaker_opens_then_half_opens(self):
+        self.providers["a"].status = 503
+        await self.start_clients()
+        for _ in range(bot.SHORTENER_BREAKER_FAILURES):
+            await bot.shorten_url(long_url())
+        self.assertTrue(bot._breaker_open("a"))
+        calls = self.providers["a"].calls
+        await bot.shorten_url(long_url())
+        self.assertEqual(self.providers["a"].calls, calls)   # açıkken çağrılmaz
+
+        await asyncio.sleep(bot.SHORTENER_BREAKER_COOLDOWN + 0.05)
+        self.assertFalse(bot._breaker_open("a"))
+        await bot.shorten_url(long_url())                     # half-open: tek deneme
+        self.assertEqual(self.providers["a"].calls, calls + 1)
+        self.assertTrue(bot._breaker_open("a"))               # yine başarısız: hemen açılır
+
+        self.providers["a"].status = 200
+        await asyncio.sleep(bot.SHORTENER_BREAKER_COOLDOWN + 0.05)
+        short = await bot.shorten_url(long_url())
+        self.assertTrue(short.startswith("http://s.test/a/"))
+        self.assertEqual(bot._breakers["a"]["failures"], 0)
+
+    async def test_slow_provider_pool_does_not_block_hedge(self):
+        bot.SHORTENER_MAX_CONNECTIONS = 4
+        self.providers["a"].latency = 2.0
+        await self.start_clients()
+        results = await asyncio.gather(*(bot.shorten_url(long_url()) for _ in range(40)))
+        # a'nın havuzu dolu olsa da b kendi havuzundan bütçe içinde cevap verir
+        self.assertFalse([r for r in results if not r.startswith(("http://s.test/b/", "http://s.test/c/"))])
+        self.assertEqual(self.providers["b"].calls, 40)
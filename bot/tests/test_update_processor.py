@@ -0,0 +1,49 @@
+"""ChatOrderedUpdateProcessor: sohbet sırası ve eşzamanlılık sınırı."""
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import bot
+
+
+def chat_update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+class ChatOrderedUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.processor = bot.ChatOrderedUpdateProcessor(2)
+        self.active = 0
+        self.peak = 0
+        self.done = []
+
+    async def handle(self, key, gate=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await (gate.wait() if gate else asyncio.sleep(0.01))
+        finally:
+            self.active -= 1
+        self.done.append(key)
+
+    def submit(self, chat_id, key, gate=None):
+        return asyncio.create_task(
+            self.processor.process_update(chat_update(chat_id), self.handle(key, gate)))
+
+    async def test_busy_chat_does_not_block_other_chats(self):
+        gate = asyncio.Event()
+        busy = [self.submit(1, ("a", i), gate) for i in range(10)]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(self.submit(2, ("b", 0)), timeout=1)
+        self.assertEqual(self.done, [("b", 0)])
+
+        gate.set()
+        await asyncio.gather(*busy)
+        self.assertEqual(self.done[1:], [("a", i) for i in range(10)])
+
+    async def test_limit_applies_across_chats(self):
+        self.assertEqual(self.processor.limit, 2)
+        await asyncio.gather(*(self.submit(chat_id, chat_id) for chat_id in range(10)))
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(sorted(self.done), list(range(10)))
+        self.assertEqual(self.processor._chat_locks, {})
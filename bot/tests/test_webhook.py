@@ -0,0 +1,64 @@
+"""Webhook endpoint'i: yerel sunucuya gerçek HTTP POST'larıyla update gönderilir."""
+import asyncio, json, types, unittest
+
+import httpx
+
+import bot
+
+
+def update_json(update_id: int = 1) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": -100, "type": "group", "title": "Test"},
+            "from": {"id": 1, "is_bot": False, "first_name": "t"},
+            "text": "/kalanhak",
+        },
+    }
+
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.app = types.SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        self.secret = bot.WEBHOOK_SECRET
+        bot.WEBHOOK_SECRET = "s3cret"
+        bot.web_routes[("POST", bot.WEBHOOK_PATH)] = bot.webhook_route(self.app)
+        self.server = await bot.start_web_server(0, "127.0.0.1")
+        port = self.server.sockets[0].getsockname()[1]
+        self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        self.server.close()
+        await self.server.wait_closed()
+        bot.web_routes.pop(("POST", bot.WEBHOOK_PATH), None)
+        bot.WEBHOOK_SECRET = self.secret
+
+    async def post(self, body: bytes, secret: str = "s3cret") -> httpx.Response:
+        return await self.client.post(bot.WEBHOOK_PATH, content=body,
+                                      headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+
+    async def test_update_is_queued(self):
+        r = await self.post(json.dumps(update_json(7)).encode())
+        self.assertEqual(r.status_code, 200)
+        update = self.app.update_queue.get_nowait()
+        self.assertEqual(update.update_id, 7)
+        self.assertEqual(update.effective_chat.id, -100)
+
+    async def test_wrong_secret_is_rejected(self):
+        r = await self.post(json.dumps(update_json()).encode(), secret="yanlis")
+        self.assertEqual(r.status_code, 403)
+        self.assertTrue(self.app.update_queue.empty())
+
+    async def test_non_object_bodies_are_rejected(self):
+        for body in (b"null", b"[]", b"[1, 2]", b'"x"', b"42", b"{bozuk"):
+            with self.subTest(body=body):
+                r = await self.post(body)
+                self.assertEqual(r.status_code, 400)
+        self.assertTrue(self.app.update_queue.empty())
+
+    async def test_get_is_not_allowed(self):
+        r = await self.client.get(bot.WEBHOOK_PATH)
+        self.assertEqual(r.status_code, 405)